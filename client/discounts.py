@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.db.models import DecimalField, F, Max, Q, Value
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+from django_redis import get_redis_connection
+from .models import ProductModel, OfferModel
+from .utils import chunked
+
+DISCOUNTS_UPDATE_BATCH_SIZE = 1000
+
+DISCOUNTS_LOCK_KEY = "discounts:lock"
+DISCOUNTS_SCHEDULED_KEY = "discounts:scheduled"
+DISCOUNTS_PENDING_FULL_KEY = "discounts:pending-full"
+DISCOUNTS_PENDING_CATEGORIES_KEY = "discounts:pending-categories"
+DISCOUNTS_PENDING_TRIGGERS_KEY = "discounts:pending-triggers"
+
+
+def get_offers_with_calculated_discount(offers):
+    promotion = "product__categories__promotionmodel"
+    active_promotion = Q(**{f"{promotion}__start_date__lte": Now(), f"{promotion}__end_date__gte": Now()})
+    return offers.annotate(
+        calculated_discount=Coalesce(
+            Max(f"{promotion}__discount", filter=active_promotion),
+            Value(0),
+            output_field=DecimalField(max_digits=10, decimal_places=3)
+        )
+    )
+
+
+def get_category_offers(category_uuids):
+    # Filtering through a subquery keeps the category join of the discount aggregation unconstrained
+    return OfferModel.objects.filter(product__in=ProductModel.objects.filter(categories__in=category_uuids).values("uuid"))
+
+
+def update_offer_discounts(offers=None):
+    offers = OfferModel.objects.all() if offers is None else offers
+    changed_discounts = list(
+        get_offers_with_calculated_discount(offers)
+        .exclude(discount=F("calculated_discount"))
+        .values_list("uuid", "calculated_discount")
+    )
+
+    last_changed = timezone.now()
+    for changed_discounts_batch in chunked(changed_discounts, DISCOUNTS_UPDATE_BATCH_SIZE):
+        OfferModel.objects.bulk_update(
+            [OfferModel(uuid=offer_uuid, discount=discount, last_changed=last_changed) for offer_uuid, discount in changed_discounts_batch],
+            ["discount", "last_changed"]
+        )
+
+    return [offer_uuid for offer_uuid, _discount in changed_discounts]
+
+
+# Coalescing
+
+
+def get_discounts_lock():
+    return get_redis_connection("default").lock(DISCOUNTS_LOCK_KEY, timeout=settings.DISCOUNTS_LOCK_TIMEOUT)
+
+
+def add_pending_discounts_calculation(category_uuids=None):
+    with get_redis_connection("default").pipeline() as pipeline:
+        if category_uuids:
+            pipeline.sadd(DISCOUNTS_PENDING_CATEGORIES_KEY, *category_uuids)
+        else:
+            pipeline.set(DISCOUNTS_PENDING_FULL_KEY, 1)
+        pipeline.incr(DISCOUNTS_PENDING_TRIGGERS_KEY)
+        pipeline.set(DISCOUNTS_SCHEDULED_KEY, 1, nx=True, ex=settings.DISCOUNTS_LOCK_TIMEOUT)
+        *_, is_first_trigger = pipeline.execute()
+    return bool(is_first_trigger)
+
+
+def pop_pending_discounts_calculation():
+    with get_redis_connection("default").pipeline() as pipeline:
+        pipeline.smembers(DISCOUNTS_PENDING_CATEGORIES_KEY)
+        pipeline.get(DISCOUNTS_PENDING_FULL_KEY)
+        pipeline.get(DISCOUNTS_PENDING_TRIGGERS_KEY)
+        pipeline.delete(DISCOUNTS_PENDING_CATEGORIES_KEY, DISCOUNTS_PENDING_FULL_KEY, DISCOUNTS_PENDING_TRIGGERS_KEY, DISCOUNTS_SCHEDULED_KEY)
+        category_uuids, is_full, triggers_count, _deleted_count = pipeline.execute()
+    category_uuids = None if is_full else [category_uuid.decode() for category_uuid in category_uuids]
+    return (category_uuids, int(triggers_count or 0))
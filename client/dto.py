@@ -1,25 +1,59 @@
-from django.conf import settings
-from .models import ProductModel, OfferModel, PromotionModel, CurrencyModel, CurrencyConversionModel, OrderModel, OrderOfferModel, ORDER_STATUS
+from django.db.models import Prefetch
+from .models import ProductModel, PromotionModel, CurrencyModel, OrderModel, OrderOfferModel, ORDER_STATUS
+from .pricing import OfferPrice, get_offer_prices
+
+PRODUCT_LIST_FIELDS = ["uuid", "name", "description"]
+OFFER_LIST_FIELDS = ["uuid", "product_id", "price", "discount", "currency_id", "product__name", "product__description"]
+OFFER_PRICED_LIST_FIELDS = ["uuid", "product_id", "product__name", "product__description", "offer_price", "offer_price_discounted"]
+
+
+def get_product_categories(product_uuids):
+    product_categories = {product_uuid: [] for product_uuid in product_uuids}
+    categories = ProductModel.categories.through.objects.filter(productmodel__in=product_categories.keys()).values_list(
+        "productmodel", "categorymodel", "categorymodel__name")
+    for product_uuid, category_uuid, category_name in categories:
+        product_categories[product_uuid].append({'uuid': category_uuid, 'name': category_name})
+    return product_categories
 
 
 class ProductListDto(dict):
-    def __init__(self, product_model: ProductModel):
-        self['uuid'] = product_model.uuid
-        self['name'] = product_model.name
-        self['description'] = product_model.description
-        self['categories'] = product_model.get_categories()
+    def __init__(self, product_row, categories):
+        self['uuid'] = product_row.uuid
+        self['name'] = product_row.name
+        self['description'] = product_row.description
+        self['categories'] = categories
 
 
 class OfferListDto(dict):
-    def __init__(self, offer_model: OfferModel, currency_model: CurrencyModel):
-        self['uuid'] = offer_model.uuid
-        self['name'] = offer_model.product.name
-        self['description'] = offer_model.product.description
-        self['categories'] = offer_model.product.get_categories()
+    def __init__(self, offer_row, offer_price: OfferPrice, categories):
+        self['uuid'] = offer_row.uuid
+        self['name'] = offer_row.product__name
+        self['description'] = offer_row.product__description
+        self['categories'] = categories
+        self['price'] = f"{offer_price.price:.2f}"
+        self['price_discounted'] = f"{offer_price.price_discounted:.2f}"
+
+
+def get_product_list_dtos(product_rows):
+    product_rows = list(product_rows)
+    product_categories = get_product_categories([product_row.uuid for product_row in product_rows])
+    return [ProductListDto(product_row, product_categories[product_row.uuid]) for product_row in product_rows]
+
 
-        currency_conversion = CurrencyConversionModel.objects.get(source=offer_model.currency, destination=currency_model)
-        self['price'] = offer_model.get_price(currency_conversion)
-        self['price_discounted'] = offer_model.get_price_discounted(currency_conversion)
+def get_offer_list_dtos(offer_rows, currency_model: CurrencyModel):
+    offer_rows = list(offer_rows)
+    offer_prices = get_offer_prices(offer_rows, currency_model)
+    product_categories = get_product_categories([offer_row.product_id for offer_row in offer_rows])
+    return [OfferListDto(offer_row, offer_prices[offer_row.uuid], product_categories[offer_row.product_id]) for offer_row in offer_rows]
+
+
+def get_priced_offer_list_dtos(offer_rows):
+    offer_rows = list(offer_rows)
+    product_categories = get_product_categories([offer_row.product_id for offer_row in offer_rows])
+    return [
+        OfferListDto(offer_row, OfferPrice(offer_row.offer_price, offer_row.offer_price_discounted), product_categories[offer_row.product_id])
+        for offer_row in offer_rows
+    ]
 
 
 class PromotionListDto(dict):
@@ -40,22 +74,33 @@ class CurrencyListDto(dict):
         self['code'] = currency_model.code
 
 
+def get_order_list_rows(order_rows, summary=False):
+    # Currency is joined and, unless only the stored summary is needed, all lines of the page are read in one extra query
+    order_rows = order_rows.select_related("currency")
+    if not summary:
+        order_rows = order_rows.prefetch_related(
+            Prefetch("orderoffermodel_set", queryset=OrderOfferModel.objects.select_related("offer__product").order_by("id")))
+    return order_rows
+
+
 class OrderListDto(dict):
-    def __init__(self, order_model: OrderModel):
+    def __init__(self, order_model: OrderModel, summary=False):
         self['uuid'] = order_model.uuid
         self['price'] = f"{order_model.total_price} {order_model.currency.code}"
         self['status'] = ORDER_STATUS[order_model.status][1]
         self['date'] = order_model.date.strftime("%d/%m/%Y")
-        self['invoice'] = settings.MEDIA_URL + order_model.invoice.__str__()
-
-        offers = []
-        order_offers = OrderOfferModel.objects.all().filter(order=order_model)
-        for order_offer in order_offers:
-            offer = {
-                'offerUuid': order_offer.offer.uuid,
-                'name': order_offer.offer.product.name,
-                'price': f"{order_offer.price * order_offer.quantity} {order_model.currency.code}",
-                'quantity': order_offer.quantity
-            }
-            offers.append(offer)
-        self['offers'] = offers
+        self['invoice'] = order_model.invoice.url if order_model.invoice else None
+        self['lineCount'] = order_model.line_count
+        self['itemSummary'] = order_model.item_summary
+
+        if not summary:
+            offers = []
+            for order_offer in order_model.orderoffermodel_set.all():
+                offer = {
+                    'offerUuid': order_offer.offer.uuid,
+                    'name': order_offer.offer.product.name,
+                    'price': f"{order_offer.price * order_offer.quantity} {order_model.currency.code}",
+                    'quantity': order_offer.quantity
+                }
+                offers.append(offer)
+            self['offers'] = offers
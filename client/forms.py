@@ -13,6 +13,7 @@ from django_prose_editor.fields import ProseEditorFormField
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, AuthenticationForm, PasswordChangeForm
 from cities_light.models import Country, City
 from .models import CategoryModel, UnitModel, ProductModel, ProfileModel, OfferModel, PromotionModel, PROFILE_FIELDS
+from .search import search_products
 
 logger = logging.getLogger('django')
 
@@ -28,6 +29,12 @@ CONTACT_MESSAGE_TYPE_CHOICES = [
 
 PAGINATION_CHOICES = [(5, "5"), (10, "10"), (25, "25")]
 
+OFFER_ORDER_CHOICES = [
+    ("", "Default"),
+    ("price", "Price ascending"),
+    ("-price", "Price descending")
+]
+
 # Custom fields
 
 
@@ -78,11 +85,11 @@ class CityChoiceWidget(select2.ModelSelect2Widget):
 class ProductChoiceWidget(select2.ModelSelect2Widget):
     queryset = ProductModel.objects.all()
     empty_label = ''
-    search_fields = [
-        "name__icontains",
-        "description__icontains",
-        "details__icontains"
-    ]
+
+    def filter_queryset(self, request, term, queryset=None, **dependent_fields):
+        if queryset is None:
+            queryset = self.get_queryset()
+        return search_products(queryset, term)
 
     def label_from_instance(self, obj):
         return f"{obj.name} - {obj.description}"
@@ -263,6 +270,9 @@ class FilterOffersForm(forms.Form):
     name = forms.CharField(max_length=100, label="Name", required=False)
     category = CategoryChoiceField(
         queryset=CategoryModel.objects.all().order_by("name"), required=False, empty_label="None")
+    min_price = forms.DecimalField(label="Minimum price", required=False, min_value=0, decimal_places=2)
+    max_price = forms.DecimalField(label="Maximum price", required=False, min_value=0, decimal_places=2)
+    order = forms.ChoiceField(choices=OFFER_ORDER_CHOICES, label="Sort by", required=False)
 
 
 class OfferAddEditForm(forms.ModelForm):
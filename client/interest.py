@@ -0,0 +1,236 @@
+import json
+import uuid
+import logging
+from collections import Counter
+from datetime import UTC, date, datetime
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .models import OfferModel, ProfileModel, OfferViewModel, CategoryInterestModel
+from .utils import chunked
+
+OFFER_VIEWS_BUFFER_KEY = "offer-views:buffer"
+OFFER_VIEWS_FLUSH_LOCK_KEY = "offer-views:flush-lock"
+OFFER_VIEW_PARTITION_SUFFIX_FORMAT = "_y%Ym%m"
+
+logger = logging.getLogger('django')
+
+
+# Buffering
+
+
+def buffer_offer_view(user_uuid, offer_uuid):
+    # Returns how many views are waiting to be flushed, or None when the view could not be buffered
+    offer_view = json.dumps({"user": str(user_uuid), "offer": str(offer_uuid), "date_time": timezone.now().isoformat()})
+    try:
+        return get_redis_connection("default").rpush(OFFER_VIEWS_BUFFER_KEY, offer_view)
+    except RedisError as error:
+        # Losing a view is preferable to failing the page it was recorded for
+        logger.warning(f"Could not buffer an offer view: {error}")
+        return None
+
+
+def peek_buffered_offer_views(count):
+    offer_views = get_redis_connection("default").lrange(OFFER_VIEWS_BUFFER_KEY, 0, count - 1)
+    return [json.loads(offer_view) for offer_view in offer_views]
+
+
+def trim_buffered_offer_views(count):
+    get_redis_connection("default").ltrim(OFFER_VIEWS_BUFFER_KEY, count, -1)
+
+
+def get_offer_views_flush_lock():
+    return get_redis_connection("default").lock(OFFER_VIEWS_FLUSH_LOCK_KEY, timeout=settings.OFFER_VIEW_FLUSH_LOCK_TIMEOUT)
+
+
+# Flushing
+
+
+def trim_user_offer_views(user_uuids):
+    # Only the latest views of each user are kept, ranked in the database instead of one user at a time
+    stale_offer_view_uuids = list(
+        OfferViewModel.objects.filter(user_id__in=user_uuids)
+        .annotate(rank=Window(RowNumber(), partition_by=F("user_id"), order_by=[F("date_time").desc(), F("uuid").desc()]))
+        .filter(rank__gt=settings.OFFER_VIEW_USER_HISTORY_SIZE)
+        .values_list("uuid", flat=True)
+    )
+    OfferViewModel.objects.filter(uuid__in=stale_offer_view_uuids).delete()
+    return len(stale_offer_view_uuids)
+
+
+def save_offer_views(offer_views):
+    # Offers or users deleted since the view was buffered are dropped instead of failing the whole batch
+    offer_uuids = OfferModel.objects.filter(uuid__in={offer_view["offer"] for offer_view in offer_views}).values_list("uuid", flat=True)
+    user_uuids = ProfileModel.objects.filter(uuid__in={offer_view["user"] for offer_view in offer_views}).values_list("uuid", flat=True)
+    offer_uuids, user_uuids = {str(offer_uuid) for offer_uuid in offer_uuids}, {str(user_uuid) for user_uuid in user_uuids}
+
+    offer_view_models = [
+        OfferViewModel(user_id=offer_view["user"], offer_id=offer_view["offer"], date_time=parse_datetime(offer_view["date_time"]))
+        for offer_view in offer_views
+        if offer_view["offer"] in offer_uuids and offer_view["user"] in user_uuids
+    ]
+    create_missing_offer_view_partitions({get_month(offer_view_model.date_time) for offer_view_model in offer_view_models})
+    OfferViewModel.objects.bulk_create(offer_view_models)
+    return offer_view_models
+
+
+def count_category_interests(offer_view_models):
+    offer_categories = {}
+    offers = OfferModel.objects.filter(uuid__in={offer_view_model.offer_id for offer_view_model in offer_view_models}, product__categories__isnull=False)
+    for offer_uuid, category_uuid in offers.values_list("uuid", "product__categories"):
+        offer_categories.setdefault(str(offer_uuid), []).append(category_uuid)
+
+    view_counts = Counter()
+    for offer_view_model in offer_view_models:
+        month = get_month(offer_view_model.date_time)
+        for category_uuid in offer_categories.get(str(offer_view_model.offer_id), []):
+            view_counts[offer_view_model.user_id, category_uuid, month] += 1
+    if not view_counts:
+        return 0
+
+    # Counters are incremented in place, so concurrent flushes add up instead of overwriting each other
+    fields = [CategoryInterestModel._meta.get_field(field_name) for field_name in ["uuid", "user", "category", "month", "view_count"]]
+    table = CategoryInterestModel._meta.db_table
+    for interest_keys in chunked(sorted(view_counts.keys()), settings.OFFER_VIEW_FLUSH_BATCH_SIZE):
+        values = []
+        for interest_key in interest_keys:
+            interest_values = [uuid.uuid4(), *interest_key, view_counts[interest_key]]
+            values += [field.get_db_prep_save(value, connection) for field, value in zip(fields, interest_values)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(field.column for field in fields)}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(interest_keys))} "
+                f"ON CONFLICT (user_id, category_id, month) DO UPDATE SET view_count = {table}.view_count + EXCLUDED.view_count",
+                values
+            )
+    return len(view_counts)
+
+
+def get_interested_user_uuids(category_uuid):
+    # Only the months whose views are still retained count towards a user's interest
+    return (
+        CategoryInterestModel.objects.filter(category_id=category_uuid, month__gte=get_oldest_kept_month(settings.OFFER_VIEW_RETENTION_MONTHS))
+        .values("user_id")
+        .annotate(view_count=Sum("view_count"))
+        .filter(view_count__gte=settings.OFFER_VIEW_PROMOTION_MINIMUM_INTEREST)
+        .order_by("user_id")
+        .values_list("user_id", flat=True)
+    )
+
+
+def flush_buffered_offer_views():
+    # Returns None when another flush is already draining the buffer
+    flush_lock = get_offer_views_flush_lock()
+    if not flush_lock.acquire(blocking=False):
+        return None
+    try:
+        # Only the views buffered when the flush starts are drained, later ones wait for the next flush
+        buffered_count = get_redis_connection("default").llen(OFFER_VIEWS_BUFFER_KEY)
+        saved_count, trimmed_count = 0, 0
+        for _ in range(0, buffered_count, settings.OFFER_VIEW_FLUSH_BATCH_SIZE):
+            offer_views = peek_buffered_offer_views(settings.OFFER_VIEW_FLUSH_BATCH_SIZE)
+            if not offer_views:
+                break
+            with transaction.atomic():
+                offer_view_models = save_offer_views(offer_views)
+                count_category_interests(offer_view_models)
+            # A batch leaves the buffer only once it is committed, so a failing flush leaves it for the next one
+            trim_buffered_offer_views(len(offer_views))
+            trimmed_count += trim_user_offer_views({offer_view_model.user_id for offer_view_model in offer_view_models})
+            saved_count += len(offer_view_models)
+        return saved_count, trimmed_count
+    finally:
+        flush_lock.release()
+
+
+# Partitions
+
+
+def get_next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def get_previous_month(month):
+    return date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+
+
+def get_month(date_time):
+    return date_time.astimezone(UTC).date().replace(day=1)
+
+
+def get_oldest_kept_month(retention_months):
+    oldest_kept_month = get_month(timezone.now())
+    for _ in range(retention_months):
+        oldest_kept_month = get_previous_month(oldest_kept_month)
+    return oldest_kept_month
+
+
+def get_offer_view_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE parent.relname = %s",
+            [OfferViewModel._meta.db_table]
+        )
+        return [partition_name for partition_name, in cursor.fetchall()]
+
+
+def get_offer_view_partition_name(month):
+    return OfferViewModel._meta.db_table + month.strftime(OFFER_VIEW_PARTITION_SUFFIX_FORMAT)
+
+
+def create_offer_view_partition(month):
+    partition_name = get_offer_view_partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {OfferViewModel._meta.db_table} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{get_next_month(month).isoformat()} 00:00:00+00')")
+    return partition_name
+
+
+def create_offer_view_partitions(months_ahead):
+    existing_partitions = set(get_offer_view_partitions())
+    created_partitions = []
+    month = timezone.now().date().replace(day=1)
+    for _ in range(months_ahead + 1):
+        if get_offer_view_partition_name(month) not in existing_partitions:
+            created_partitions.append(create_offer_view_partition(month))
+        month = get_next_month(month)
+    return created_partitions
+
+
+def create_missing_offer_view_partitions(months):
+    # Flushing does not wait for the daily maintenance, a month it has not prepared yet gets its partition here
+    if connection.vendor != "postgresql":
+        return []
+    existing_partitions = set(get_offer_view_partitions())
+    return [create_offer_view_partition(month) for month in sorted(months) if get_offer_view_partition_name(month) not in existing_partitions]
+
+
+def drop_expired_offer_view_partitions(retention_months):
+    # A whole month of views goes with one DROP TABLE instead of a DELETE over every row
+    oldest_kept_month = get_oldest_kept_month(retention_months)
+
+    dropped_partitions = []
+    for partition_name in get_offer_view_partitions():
+        try:
+            month = datetime.strptime(partition_name.removeprefix(OfferViewModel._meta.db_table), OFFER_VIEW_PARTITION_SUFFIX_FORMAT).date()
+        except ValueError:
+            logger.warning(f"Skipping offer view partition {partition_name}, its name does not match the monthly format.")
+            continue
+        if month < oldest_kept_month:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {partition_name}")
+            dropped_partitions.append(partition_name)
+    return dropped_partitions
+
+
+def delete_expired_category_interests(retention_months):
+    # Interest buckets follow the view partitions out, so old browsing stops counting towards promotions
+    deleted_count, _deleted = CategoryInterestModel.objects.filter(month__lt=get_oldest_kept_month(retention_months)).delete()
+    return deleted_count
@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import tempfile
+from reportlab.pdfgen import canvas
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import OrderModel, OrderOfferModel
+
+INVOICE_DIRECTORY = "pdf"
+INVOICE_OFFERS_PER_PAGE = 6
+INVOICE_HEADER_FORM = "invoice-header"
+# Bumping this gives every invoice a new name, so bulk regeneration re-renders them after a layout change
+INVOICE_LAYOUT_VERSION = 1
+
+
+def draw_invoice_header(pdf, order):
+    # Drawn once into a form XObject that every page of the invoice then references
+    pdf.beginForm(INVOICE_HEADER_FORM)
+
+    title = pdf.beginText(50, 780)
+    title.setFont("Helvetica", 22)
+    title.textLine("Online store")
+
+    subtitle = pdf.beginText(50, 760)
+    subtitle.setFont("Helvetica", 16)
+    subtitle.textLine("Invoice")
+
+    price = pdf.beginText(50, 740)
+    price.setFont("Helvetica", 12)
+    price.textLine(f"Price: {order.total_price} {order.currency.code}")
+
+    admin_email = pdf.beginText(50, 720)
+    admin_email.setFont("Helvetica", 12)
+    admin_email.textLine("Administrator email:")
+    admin_email.textLine(settings.ADMINS[0][1])
+
+    pdf.drawText(title)
+    pdf.drawText(subtitle)
+    pdf.drawText(price)
+    pdf.drawText(admin_email)
+
+    full_name = pdf.beginText(250, 790)
+    full_name.setFont("Helvetica", 12)
+    full_name.textLine(f"Full name: {order.user.get_full_name()}")
+
+    email = pdf.beginText(250, 770)
+    email.setFont("Helvetica", 12)
+    email.textLine(f"Email: {order.user.email}")
+
+    phone_number = pdf.beginText(250, 750)
+    phone_number.setFont("Helvetica", 12)
+    phone_number.textLine(f"Phone number: {order.user.phone_number}")
+
+    location = pdf.beginText(250, 730)
+    location.setFont("Helvetica", 12)
+    location.textLine(f"Location: {order.user.country} {order.user.city}")
+
+    address = pdf.beginText(250, 710)
+    address.setFont("Helvetica", 12)
+    address.textLine(f"Full address: {order.user.address_line_one} {order.user.address_line_two}")
+
+    pdf.drawText(full_name)
+    pdf.drawText(email)
+    pdf.drawText(phone_number)
+    pdf.drawText(location)
+    pdf.drawText(address)
+
+    pdf.endForm()
+
+
+def draw_invoice_page(pdf, page_number):
+    pdf.doForm(INVOICE_HEADER_FORM)
+
+    page_number_text = pdf.beginText(50, 50)
+    page_number_text.setFont("Helvetica", 12)
+    page_number_text.textLine(f"Page {page_number}")
+    pdf.drawText(page_number_text)
+
+
+def draw_invoice_line(pdf, order, order_offer, offer_box_y):
+    pdf.rect(50, offer_box_y, 500, 100)
+
+    offer_name = pdf.beginText(70, offer_box_y + 70)
+    offer_name.setFont("Helvetica", 16)
+    offer_name.textLine(order_offer.offer__product__name)
+
+    offer_description = pdf.beginText(70, offer_box_y + 55)
+    offer_description.setFont("Helvetica", 12)
+    offer_description.textLine(order_offer.offer__product__description)
+
+    offer_quantity = pdf.beginText(70, offer_box_y + 20)
+    offer_quantity.setFont("Helvetica", 12)
+    offer_quantity.textLine(f"Quantity: {order_offer.quantity}")
+
+    offer_price_str = f"Price: {order_offer.quantity * order_offer.price} {order.currency.code}"
+    offer_price_str_width = int(pdf.stringWidth(offer_price_str, "Helvetica", 12))
+    offer_price = pdf.beginText(530 - offer_price_str_width, offer_box_y + 20)
+    offer_price.setFont("Helvetica", 12)
+    offer_price.textLine(offer_price_str)
+
+    pdf.drawText(offer_name)
+    pdf.drawText(offer_description)
+    pdf.drawText(offer_quantity)
+    pdf.drawText(offer_price)
+
+
+def get_invoice_lines(order):
+    return (
+        OrderOfferModel.objects.filter(order=order)
+        .order_by("id")
+        .values_list("offer__product__name", "offer__product__description", "quantity", "price", named=True)
+    )
+
+
+def generate_invoice(path, order):
+    pdf = canvas.Canvas(path)
+    pdf.setFont("Helvetica", 12)
+    draw_invoice_header(pdf, order)
+
+    for index, order_offer in enumerate(get_invoice_lines(order)):
+        line_index = index % INVOICE_OFFERS_PER_PAGE
+        if line_index == 0:
+            if index:
+                pdf.showPage()
+            draw_invoice_page(pdf, index // INVOICE_OFFERS_PER_PAGE + 1)
+        draw_invoice_line(pdf, order, order_offer, 580 - line_index * 100)
+
+    pdf.save()
+
+    return pdf
+
+
+def get_invoice_fingerprint(order):
+    # Every input of the rendered document is hashed, so equal inputs map to the same file and changed ones never collide
+    user = order.user
+    order_offers = (
+        OrderOfferModel.objects.filter(order=order)
+        .order_by("id")
+        .values_list("offer_id", "offer__product__name", "offer__product__description", "quantity", "price")
+    )
+    invoice_inputs = {
+        "order": [order.uuid, order.total_price, order.currency.code],
+        "user": [user.get_full_name(), user.email, str(user.phone_number), str(user.country), str(user.city), user.address_line_one, user.address_line_two],
+        "offers": list(order_offers),
+        "admin_email": settings.ADMINS[0][1],
+        "layout": INVOICE_LAYOUT_VERSION
+    }
+    return hashlib.sha256(json.dumps(invoice_inputs, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def get_invoice_path(order):
+    return f"{INVOICE_DIRECTORY}/invoice-{get_invoice_fingerprint(order)}.pdf"
+
+
+def write_invoice(order, invoice_path):
+    invoice_absolute_path = settings.MEDIA_ROOT / invoice_path
+    invoice_absolute_path.parent.mkdir(parents=True, exist_ok=True)
+    # Rendering into a temporary file and renaming it means readers never see a half written invoice
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=invoice_absolute_path.parent, suffix=".pdf.tmp")
+    os.close(file_descriptor)
+    try:
+        generate_invoice(temporary_path, order)
+        os.replace(temporary_path, invoice_absolute_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def render_order_invoice(order: OrderModel):
+    invoice_path = get_invoice_path(order)
+    if not (settings.MEDIA_ROOT / invoice_path).exists():
+        write_invoice(order, invoice_path)
+    OrderModel.objects.filter(uuid=order.uuid).update(invoice=invoice_path)
+    return invoice_path
+
+
+def regenerate_order_invoice(order_uuid, force=False):
+    order = OrderModel.objects.select_related("user", "currency").get(uuid=order_uuid)
+    invoice_path = get_invoice_path(order)
+    if not force and order.invoice.name == invoice_path and (settings.MEDIA_ROOT / invoice_path).exists():
+        return False
+
+    write_invoice(order, invoice_path)
+    OrderModel.objects.filter(uuid=order.uuid).update(invoice=invoice_path)
+    return True
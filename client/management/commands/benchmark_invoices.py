@@ -0,0 +1,54 @@
+import io
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from client.models import ProfileModel, CurrencyModel, ProductModel, OfferModel, OrderModel, OrderOfferModel
+from client.invoices import generate_invoice
+
+
+class Command(BaseCommand):
+    help = "Reports how many invoices per second are rendered for orders of different sizes, the generated data is rolled back"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 500], help="Order line counts to benchmark")
+        parser.add_argument("--iterations", type=int, default=20, help="Invoices rendered for each order size")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            currency = CurrencyModel.objects.get(code=settings.DEFAULT_CURRENCY_CODE)
+            user = ProfileModel.objects.create(
+                username=f"benchmark-{int(time.time())}",
+                email="benchmark@example.com",
+                first_name="Benchmark",
+                last_name="User",
+                phone_number="+40700000000",
+                address_line_one="Benchmark street 1"
+            )
+            product = ProductModel.objects.create(name="Benchmark product", description="Product used to benchmark invoices")
+            offer = OfferModel.objects.create(product=product, price=Decimal("9.99"), currency=currency)
+
+            for lines_count in options["lines"]:
+                order = OrderModel.objects.create(
+                    user=user,
+                    full_address=user.get_full_address(),
+                    phone_number=user.phone_number,
+                    currency=currency,
+                    total_price=offer.price * lines_count
+                )
+                OrderOfferModel.objects.bulk_create(
+                    [OrderOfferModel(order=order, offer=offer, quantity=1, price=offer.price) for _ in range(lines_count)]
+                )
+                order = OrderModel.objects.select_related("user", "currency").get(uuid=order.uuid)
+
+                start_time = time.perf_counter()
+                for _ in range(options["iterations"]):
+                    generate_invoice(io.BytesIO(), order)
+                elapsed_seconds = time.perf_counter() - start_time
+
+                self.stdout.write(
+                    f"{lines_count:>5} lines: {options['iterations'] / elapsed_seconds:8.1f} invoices/s "
+                    f"({elapsed_seconds / options['iterations'] * 1000:.1f} ms each)")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,81 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from client.models import CurrencyModel, CurrencyConversionModel
+from client.rates import invalidate_currency_rates
+from client.tasks import update_offer_prices
+
+
+def read_rates_file(path):
+    if path.suffix == ".json":
+        data = json.loads(path.read_text())
+        return data.get("base"), data["rates"].items()
+    with path.open(newline="") as file:
+        return None, [(row[0], row[1]) for row in csv.reader(file) if row and not row[0].startswith("#")]
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports conversion rates against the base currency from a local JSON ({\"base\": \"RON\", \"rates\": {\"EUR\": 0.2}}) "
+        "or CSV (code,rate per line) file. A rate is the amount of the currency worth one unit of the base currency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--prune", action="store_true", help="Delete conversions between non-base currencies, cross rates are derived instead")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path.is_file():
+            raise CommandError(f"Could not find rates file: {path}")
+
+        base_currency_code, rates = read_rates_file(path)
+        base_currency_code = base_currency_code or settings.BASE_CURRENCY_CODE
+        if base_currency_code != settings.BASE_CURRENCY_CODE:
+            raise CommandError(f"Rates file is based on {base_currency_code}, expected {settings.BASE_CURRENCY_CODE}!")
+
+        currencies = {currency.code: currency for currency in CurrencyModel.objects.all()}
+        if base_currency_code not in currencies:
+            raise CommandError(f"Base currency {base_currency_code} does not exist!")
+        base_currency = currencies[base_currency_code]
+
+        parsed_rates = {}
+        for currency_code, rate in rates:
+            currency_code = currency_code.strip().upper()
+            if currency_code not in currencies:
+                self.stderr.write(self.style.WARNING(f"Skipping unknown currency {currency_code}."))
+                continue
+            try:
+                parsed_rates[currencies[currency_code].uuid] = Decimal(str(rate).strip())
+            except InvalidOperation:
+                raise CommandError(f"Invalid rate for {currency_code}: {rate}")
+
+        with transaction.atomic():
+            existing_conversions = {
+                conversion.destination_id: conversion
+                for conversion in CurrencyConversionModel.objects.select_for_update().filter(source=base_currency)
+            }
+            new_conversions = []
+            for currency_uuid, rate in parsed_rates.items():
+                if currency_uuid in existing_conversions:
+                    existing_conversions[currency_uuid].rate = rate
+                else:
+                    new_conversions.append(CurrencyConversionModel(source=base_currency, destination_id=currency_uuid, rate=rate))
+            CurrencyConversionModel.objects.bulk_update(
+                [conversion for currency_uuid, conversion in existing_conversions.items() if currency_uuid in parsed_rates], ["rate"])
+            CurrencyConversionModel.objects.bulk_create(new_conversions)
+
+            pruned_count = 0
+            if options["prune"]:
+                # Deleted without signals, every pruned row would otherwise queue its own full price refresh
+                pruned_conversions = CurrencyConversionModel.objects.exclude(source=base_currency).exclude(destination=base_currency)
+                pruned_count = pruned_conversions._raw_delete(pruned_conversions.db)
+
+            transaction.on_commit(invalidate_currency_rates)
+            transaction.on_commit(update_offer_prices.delay)
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(parsed_rates)} rates against {base_currency_code}, pruned {pruned_count} conversions."))
@@ -0,0 +1,118 @@
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from client.models import ProfileModel, CurrencyModel, SupplierModel, ProductModel, ProductStockModel, StockModel, OfferModel, OrderModel, OrderOfferModel, OrderOfferStockModel
+from client.orders import StockContentionError, place_order
+from client.stock import InsufficientStockError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires parallel checkouts at a single throwaway product and verifies that stock is never oversold "
+        "and no partial orders are left behind. Run it against PostgreSQL, the test data is removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkouts", type=int, default=300)
+        parser.add_argument("--workers", type=int, default=50)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument("--quantity", type=int, default=1, help="Quantity bought by each checkout")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated test data")
+
+    def handle(self, *args, **options):
+        if options["workers"] > options["checkouts"]:
+            raise CommandError("There cannot be more workers than checkouts!")
+
+        currency = CurrencyModel.objects.get(code=settings.DEFAULT_CURRENCY_CODE)
+        label = f"loadtest-{int(time.time())}"
+        user = ProfileModel.objects.create_user(username=label, email=f"{label}@example.com", phone_number="+40700000000")
+        supplier = SupplierModel.objects.create(name=label)
+        product = ProductModel.objects.create(name=label)
+        StockModel.objects.create(product=product, supplier=supplier, quantity=options["stock"], reception_date=timezone.now())
+        offer = OfferModel.objects.create(product=product, price=Decimal(1), currency=currency)
+
+        try:
+            outcomes, elapsed_seconds = self.run_checkouts(user, currency, offer, options)
+            self.report(outcomes, elapsed_seconds, options)
+            self.verify(user, product, offer, outcomes, options)
+        finally:
+            if not options["keep"]:
+                OrderOfferModel.objects.filter(order__user=user).delete()
+                OrderModel.objects.filter(user=user).delete()
+                StockModel.objects.filter(product=product).delete()
+                offer.delete()
+                product.delete()
+                supplier.delete()
+                user.delete()
+
+    def run_checkouts(self, user, currency, offer, options):
+        barrier = threading.Barrier(options["workers"])
+        offer_quantities = {str(offer.uuid): options["quantity"]}
+
+        def checkout(index):
+            # The first wave of workers starts at once so they all contend for the same stock row
+            if index < options["workers"]:
+                barrier.wait()
+            try:
+                place_order(user, currency, offer_quantities)
+                return "placed"
+            except InsufficientStockError:
+                return "out of stock"
+            except StockContentionError:
+                return "contended"
+            except Exception as error:
+                return f"failed: {type(error).__name__}: {error}"
+            finally:
+                connections.close_all()
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            outcomes = Counter(executor.map(checkout, range(options["checkouts"])))
+        return outcomes, time.perf_counter() - start_time
+
+    def report(self, outcomes, elapsed_seconds, options):
+        self.stdout.write(
+            f"{options['checkouts']} checkouts with {options['workers']} workers in {elapsed_seconds:.2f}s "
+            f"({options['checkouts'] / elapsed_seconds:.1f}/s)")
+        for outcome, count in outcomes.most_common():
+            self.stdout.write(f"  {outcome}: {count}")
+
+    def verify(self, user, product, offer, outcomes, options):
+        placed_count = outcomes["placed"]
+        orders_count = OrderModel.objects.filter(user=user).count()
+        sold_quantity = OrderOfferModel.objects.filter(offer=offer).aggregate(Sum("quantity"))["quantity__sum"] or 0
+        remaining_quantity = ProductStockModel.objects.get(product=product).quantity
+        remaining_stock_quantity = StockModel.objects.filter(product=product).aggregate(Sum("quantity"))["quantity__sum"]
+        allocated_quantity = OrderOfferStockModel.objects.filter(stock__product=product).aggregate(Sum("quantity"))["quantity__sum"] or 0
+        orphan_orders_count = OrderModel.objects.filter(user=user, orderoffermodel__isnull=True).count()
+
+        violations = []
+        if orders_count != placed_count:
+            violations.append(f"{orders_count} orders saved for {placed_count} successful checkouts")
+        if orphan_orders_count:
+            violations.append(f"{orphan_orders_count} orders saved without lines")
+        if sold_quantity != placed_count * options["quantity"]:
+            violations.append(f"sold {sold_quantity} items in {placed_count} checkouts of {options['quantity']}")
+        if sold_quantity > options["stock"]:
+            violations.append(f"oversold: {sold_quantity} sold out of {options['stock']}")
+        if remaining_quantity != options["stock"] - sold_quantity:
+            violations.append(f"remaining stock is {remaining_quantity}, expected {options['stock'] - sold_quantity}")
+        if remaining_stock_quantity != remaining_quantity:
+            violations.append(f"stock lots hold {remaining_stock_quantity}, the summary says {remaining_quantity}")
+        if allocated_quantity != sold_quantity:
+            violations.append(f"{allocated_quantity} items allocated from lots for {sold_quantity} sold")
+        if any(outcome.startswith("failed") for outcome in outcomes):
+            violations.append("unexpected checkout failures")
+
+        if violations:
+            for violation in violations:
+                self.stdout.write(self.style.ERROR(violation))
+            raise CommandError("Checkout invariants were violated!")
+        self.stdout.write(self.style.SUCCESS(f"Invariants hold: sold {sold_quantity} of {options['stock']}, {remaining_quantity} remaining."))
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from client.models import ProductStockModel, next_stock_version
+from client.push import publish_product_stocks_on_commit
+from client.stock import get_expected_product_stocks
+
+
+class Command(BaseCommand):
+    help = "Verifies the product stock summary against the sellable stock lots"
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_uuids", nargs="*", help="Only verify the stock of these products")
+        parser.add_argument("--fix", action="store_true", help="Overwrite mismatching summaries with the expected quantities")
+
+    def handle(self, *args, **options):
+        product_uuids = options["product_uuids"] or None
+
+        with transaction.atomic():
+            product_stocks = ProductStockModel.objects.select_for_update()
+            if product_uuids is not None:
+                product_stocks = product_stocks.filter(product_id__in=product_uuids)
+            product_stocks = {product_stock.product_id: product_stock for product_stock in product_stocks}
+            expected_product_stocks = get_expected_product_stocks(product_uuids)
+
+            mismatched_product_stocks = []
+            missing_product_stocks = []
+            for product_uuid, expected_quantity in expected_product_stocks.items():
+                product_stock = product_stocks.get(product_uuid)
+                if product_stock is None:
+                    self.stdout.write(f"{product_uuid}: missing summary, expected {expected_quantity}")
+                    missing_product_stocks.append(ProductStockModel(product_id=product_uuid, quantity=expected_quantity))
+                elif product_stock.quantity != expected_quantity:
+                    self.stdout.write(f"{product_uuid}: summary {product_stock.quantity}, expected {expected_quantity}")
+                    product_stock.quantity = expected_quantity
+                    product_stock.version = next_stock_version()
+                    mismatched_product_stocks.append(product_stock)
+
+            if options["fix"]:
+                ProductStockModel.objects.bulk_update(mismatched_product_stocks, ["quantity", "version"])
+                ProductStockModel.objects.bulk_create(missing_product_stocks)
+                publish_product_stocks_on_commit([product_stock.product_id for product_stock in mismatched_product_stocks + missing_product_stocks])
+
+        discrepancies_count = len(mismatched_product_stocks) + len(missing_product_stocks)
+        if not discrepancies_count:
+            self.stdout.write(self.style.SUCCESS(f"All {len(expected_product_stocks)} product stocks match."))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {discrepancies_count} product stocks."))
+        else:
+            self.stdout.write(self.style.ERROR(f"Found {discrepancies_count} mismatching product stocks, run with --fix to repair them."))
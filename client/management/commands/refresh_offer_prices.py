@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from client.models import OfferModel
+from client.pricing import refresh_offer_prices, refresh_missing_offer_prices
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the precomputed per-currency prices of offers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("offer_uuids", nargs="*", help="Only refresh the prices of these offers")
+        parser.add_argument("--missing", action="store_true", help="Only refresh offers that have no prices yet")
+
+    def handle(self, *args, **options):
+        if options["missing"]:
+            refreshed_count = refresh_missing_offer_prices()
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed_count} missing offer prices."))
+            return
+
+        offers = OfferModel.objects.all()
+        if options["offer_uuids"]:
+            offers = offers.filter(uuid__in=options["offer_uuids"])
+        refreshed_count = refresh_offer_prices(offers)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed_count} offer prices."))
@@ -0,0 +1,87 @@
+import os
+import time
+import functools
+import multiprocessing
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.core.management.base import BaseCommand
+from client.models import OrderModel
+from client.invoices import regenerate_order_invoice
+
+
+def regenerate_invoice(order_uuid, force):
+    try:
+        return order_uuid, "rendered" if regenerate_order_invoice(order_uuid, force) else "current"
+    except Exception as error:
+        return order_uuid, f"failed: {type(error).__name__}: {error}"
+
+
+def read_checkpoint(checkpoint_path):
+    if checkpoint_path.exists():
+        return checkpoint_path.read_text().strip() or None
+    return None
+
+
+def write_checkpoint(checkpoint_path, order_uuid):
+    temporary_path = checkpoint_path.with_suffix(".tmp")
+    temporary_path.write_text(str(order_uuid))
+    os.replace(temporary_path, checkpoint_path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the invoices of all orders again across a pool of processes, skipping invoices that are already current. "
+        "Progress is checkpointed after every chunk so an interrupted run can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=os.cpu_count())
+        parser.add_argument("--chunk-size", type=int, default=500, help="Orders read and checkpointed at a time")
+        parser.add_argument("--force", action="store_true", help="Render invoices even if they are already current")
+        parser.add_argument("--resume", action="store_true", help="Continue after the last checkpointed order")
+        parser.add_argument("--checkpoint", type=Path, default=settings.BASE_DIR / "logs" / "regenerate-invoices.checkpoint")
+
+    def get_order_uuid_chunks(self, last_order_uuid, chunk_size):
+        # Each chunk is a short keyset query, so no cursor stays open while the workers write
+        orders = OrderModel.objects.order_by("uuid").values_list("uuid", flat=True)
+        while True:
+            chunk_orders = orders if last_order_uuid is None else orders.filter(uuid__gt=last_order_uuid)
+            order_uuids_chunk = list(chunk_orders[:chunk_size])
+            if not order_uuids_chunk:
+                return
+            yield order_uuids_chunk
+            last_order_uuid = order_uuids_chunk[-1]
+
+    def handle(self, *args, **options):
+        checkpoint_path = options["checkpoint"]
+        last_order_uuid = None
+        if options["resume"]:
+            last_order_uuid = read_checkpoint(checkpoint_path)
+            if last_order_uuid is not None:
+                self.stdout.write(f"Resuming after order {last_order_uuid}.")
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Forked workers must open their own database connections instead of sharing the parent's
+        connections.close_all()
+        outcomes = {"rendered": 0, "current": 0, "failed": 0}
+        start_time = time.perf_counter()
+        with multiprocessing.Pool(processes=options["processes"]) as pool:
+            for order_uuids_chunk in self.get_order_uuid_chunks(last_order_uuid, options["chunk_size"]):
+                results = pool.imap_unordered(functools.partial(regenerate_invoice, force=options["force"]), order_uuids_chunk)
+                for order_uuid, outcome in results:
+                    if outcome.startswith("failed"):
+                        outcomes["failed"] += 1
+                        self.stderr.write(self.style.ERROR(f"{order_uuid}: {outcome}"))
+                    else:
+                        outcomes[outcome] += 1
+                write_checkpoint(checkpoint_path, order_uuids_chunk[-1])
+                self.stdout.write(
+                    f"Processed up to {order_uuids_chunk[-1]}: {outcomes['rendered']} rendered, "
+                    f"{outcomes['current']} current, {outcomes['failed']} failed.")
+
+        checkpoint_path.unlink(missing_ok=True)
+        elapsed_seconds = time.perf_counter() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {outcomes['rendered']} invoices in {elapsed_seconds:.1f}s, "
+            f"{outcomes['current']} were already current and {outcomes['failed']} failed."))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from client.models import PromotionModel
+from client.tasks import schedule_promotion_boundaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Schedules the start, end and expire boundaries of every promotion that has not expired yet. "
+        "Promotions saved before boundaries were scheduled have none, running it again only refreshes existing ones."
+    )
+
+    def handle(self, *args, **options):
+        expired_before = timezone.now() - timedelta(days=settings.PROMOTION_EXPIRED_RETENTION_DAYS)
+        promotions = PromotionModel.objects.filter(Q(end_date__isnull=True) | Q(end_date__gte=expired_before))
+        scheduled_count = 0
+        for promotion in promotions.iterator():
+            schedule_promotion_boundaries(promotion)
+            scheduled_count += 1
+        self.stdout.write(self.style.SUCCESS(f"Scheduled the boundaries of {scheduled_count} promotions."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from client.models import ProductModel
+from client.search import get_product_search_vector
+from client.utils import chunked
+
+
+class Command(BaseCommand):
+    help = "Backfills the full-text search vectors of existing products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild the search vectors of every product, not only missing ones")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        products = ProductModel.objects.all().order_by("uuid")
+        if not options["all"]:
+            products = products.filter(search_vector__isnull=True)
+
+        updated_count = 0
+        product_uuids = products.values_list("uuid", flat=True).iterator(chunk_size=options["batch_size"])
+        for product_uuids_batch in chunked(product_uuids, options["batch_size"]):
+            updated_count += ProductModel.objects.filter(uuid__in=product_uuids_batch).update(search_vector=get_product_search_vector())
+            self.stdout.write(f"Updated {updated_count} products...")
+
+        self.stdout.write(self.style.SUCCESS(f"Updated search vectors of {updated_count} products."))
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0020_ordermodel_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmodel',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='productmodel',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='client_prod_search__19d4b9_gin'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION client_productmodel_search_vector_update() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector :=
+                        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+                        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B') ||
+                        setweight(to_tsvector('english', coalesce(NEW.details, '')), 'C');
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER client_productmodel_search_vector_trigger
+                    BEFORE INSERT OR UPDATE OF name, description, details ON client_productmodel
+                    FOR EACH ROW EXECUTE FUNCTION client_productmodel_search_vector_update();
+            """,
+            reverse_sql="""
+                DROP TRIGGER client_productmodel_search_vector_trigger ON client_productmodel;
+                DROP FUNCTION client_productmodel_search_vector_update();
+            """
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0021_productmodel_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferPriceModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('price_discounted', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='client.currencymodel')),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='client.offermodel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['currency', 'price'], name='client_offe_currenc_809d3e_idx'), models.Index(fields=['currency', 'price_discounted'], name='client_offe_currenc_f4c1f4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('offer', 'currency'), name='unique_offer_price_currency')],
+            },
+        ),
+    ]
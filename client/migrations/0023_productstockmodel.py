@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+ORDER_STATUS_CANCELLED = 6
+
+
+def backfill_product_stocks(apps, schema_editor):
+    ProductModel = apps.get_model('client', 'ProductModel')
+    StockModel = apps.get_model('client', 'StockModel')
+    OrderOfferModel = apps.get_model('client', 'OrderOfferModel')
+    ProductStockModel = apps.get_model('client', 'ProductStockModel')
+
+    product_stocks = {product_uuid: 0 for product_uuid in ProductModel.objects.values_list('uuid', flat=True)}
+    for product_uuid, quantity in StockModel.objects.values_list('product_id').annotate(Sum('quantity')):
+        product_stocks[product_uuid] += quantity
+    # Stock is now reserved by orders, so what was ordered and not cancelled is taken out of the lot totals; products
+    # ordered beyond their recorded lots start from an empty stock instead of a negative one
+    ordered_offers = OrderOfferModel.objects.exclude(order__status=ORDER_STATUS_CANCELLED)
+    for product_uuid, quantity in ordered_offers.values_list('offer__product_id').annotate(Sum('quantity')):
+        product_stocks[product_uuid] -= quantity
+    ProductStockModel.objects.bulk_create(
+        [ProductStockModel(product_id=product_uuid, quantity=max(quantity, 0)) for product_uuid, quantity in product_stocks.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0022_offerpricemodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockModel',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='client.productmodel')),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_changed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_product_stocks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+ORDER_STATUS_CANCELLED = 6
+
+
+def allocate_ordered_stocks(apps, schema_editor):
+    # Stock lots now hold their remaining quantity, so everything ordered so far is drawn from them first-expired-first-out
+    StockModel = apps.get_model('client', 'StockModel')
+    OrderOfferModel = apps.get_model('client', 'OrderOfferModel')
+    OrderOfferStockModel = apps.get_model('client', 'OrderOfferStockModel')
+    ProductStockModel = apps.get_model('client', 'ProductStockModel')
+
+    ordered_offers = OrderOfferModel.objects.exclude(order__status=ORDER_STATUS_CANCELLED)
+    ordered_product_uuids = ordered_offers.values_list('offer__product_id', flat=True).distinct()
+    for product_uuid in ordered_product_uuids:
+        stocks = list(
+            StockModel.objects.filter(product_id=product_uuid, quantity__gt=0)
+            .order_by(F('expiration_date').asc(nulls_last=True), 'reception_date', 'uuid')
+        )
+        order_offers = ordered_offers.filter(offer__product_id=product_uuid).order_by('order__date', 'id')
+
+        order_offer_stocks = []
+        stock_index = 0
+        for order_offer in order_offers.iterator():
+            needed_quantity = order_offer.quantity
+            while needed_quantity > 0 and stock_index < len(stocks):
+                stock = stocks[stock_index]
+                drawn_quantity = min(needed_quantity, stock.quantity)
+                stock.quantity -= drawn_quantity
+                needed_quantity -= drawn_quantity
+                order_offer_stocks.append(OrderOfferStockModel(order_offer=order_offer, stock=stock, quantity=drawn_quantity))
+                if stock.quantity == 0:
+                    stock_index += 1
+
+        StockModel.objects.bulk_update(stocks, ['quantity'], batch_size=1000)
+        OrderOfferStockModel.objects.bulk_create(order_offer_stocks, batch_size=1000)
+
+    sellable_stocks = StockModel.objects.filter(Q(expiration_date__isnull=True) | Q(expiration_date__gt=timezone.now()))
+    product_stocks = dict(sellable_stocks.values_list('product_id').annotate(Sum('quantity')))
+    product_stock_models = list(ProductStockModel.objects.all())
+    for product_stock in product_stock_models:
+        product_stock.quantity = product_stocks.get(product_stock.product_id, 0)
+    ProductStockModel.objects.bulk_update(product_stock_models, ['quantity'], batch_size=1000)
+
+
+def release_ordered_stocks(apps, schema_editor):
+    # Lots get back what was drawn from them, so applying the migration again does not draw the same orders twice
+    StockModel = apps.get_model('client', 'StockModel')
+    OrderOfferStockModel = apps.get_model('client', 'OrderOfferStockModel')
+
+    drawn_quantities = OrderOfferStockModel.objects.values_list('stock_id').annotate(Sum('quantity')).order_by('stock_id')
+    for stock_uuid, drawn_quantity in drawn_quantities.iterator():
+        StockModel.objects.filter(uuid=stock_uuid).update(quantity=F('quantity') + drawn_quantity)
+    OrderOfferStockModel.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0023_productstockmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderOfferStockModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockmodel',
+            index=models.Index(fields=['product', 'expiration_date'], name='client_stoc_product_8445f2_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderofferstockmodel',
+            name='order_offer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stocks', to='client.orderoffermodel'),
+        ),
+        migrations.AddField(
+            model_name='orderofferstockmodel',
+            name='stock',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='client.stockmodel'),
+        ),
+        migrations.RunPython(allocate_ordered_stocks, release_ordered_stocks),
+    ]
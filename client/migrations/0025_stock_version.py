@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0024_stock_allocation'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE SEQUENCE client_stock_version_seq;",
+            reverse_sql="DROP SEQUENCE client_stock_version_seq;",
+        ),
+        migrations.AddField(
+            model_name='offermodel',
+            name='stock_version',
+            field=models.BigIntegerField(db_default=models.Func(template="nextval('client_stock_version_seq')", output_field=models.BigIntegerField())),
+        ),
+        migrations.AddField(
+            model_name='productstockmodel',
+            name='version',
+            field=models.BigIntegerField(db_default=models.Func(template="nextval('client_stock_version_seq')", output_field=models.BigIntegerField())),
+        ),
+        migrations.AddIndex(
+            model_name='offermodel',
+            index=models.Index(fields=['stock_version'], name='client_offe_stock_v_430fa6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productstockmodel',
+            index=models.Index(fields=['version'], name='client_prod_version_3eb01b_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:30
+
+from itertools import groupby
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+ORDER_ITEM_SUMMARY_NAMES = 3
+
+
+def get_order_item_summary(product_names):
+    summary = ", ".join(product_names[:ORDER_ITEM_SUMMARY_NAMES])
+    if len(product_names) > ORDER_ITEM_SUMMARY_NAMES:
+        summary += f" and {len(product_names) - ORDER_ITEM_SUMMARY_NAMES} more"
+    return Truncator(summary).chars(200)
+
+
+def summarize_orders(apps, schema_editor):
+    OrderModel = apps.get_model('client', 'OrderModel')
+    OrderOfferModel = apps.get_model('client', 'OrderOfferModel')
+
+    order_lines = OrderOfferModel.objects.order_by('order_id', 'id').values_list('order_id', 'offer__product__name')
+    orders = []
+    for order_uuid, lines in groupby(order_lines.iterator(), key=lambda line: line[0]):
+        product_names = [product_name for _, product_name in lines]
+        orders.append(OrderModel(uuid=order_uuid, line_count=len(product_names), item_summary=get_order_item_summary(product_names)))
+        if len(orders) == 1000:
+            OrderModel.objects.bulk_update(orders, ['line_count', 'item_summary'])
+            orders = []
+    OrderModel.objects.bulk_update(orders, ['line_count', 'item_summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0025_stock_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordermodel',
+            name='item_summary',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='ordermodel',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(summarize_orders, migrations.RunPython.noop),
+    ]
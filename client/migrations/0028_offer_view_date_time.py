@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0027_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offerviewmodel',
+            name='date_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from datetime import date
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+OFFER_VIEW_TABLE = 'client_offerviewmodel'
+
+
+def get_next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_offer_views(apps, schema_editor):
+    # Postgres only partitions new tables, so the view log is moved into a monthly range partitioned copy
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE} RENAME TO {OFFER_VIEW_TABLE}_old")
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE}_old RENAME CONSTRAINT {OFFER_VIEW_TABLE}_pkey TO {OFFER_VIEW_TABLE}_old_pkey")
+    schema_editor.execute(f"CREATE TABLE {OFFER_VIEW_TABLE} (LIKE {OFFER_VIEW_TABLE}_old INCLUDING DEFAULTS) PARTITION BY RANGE (date_time)")
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE} ADD PRIMARY KEY (uuid, date_time)")
+    schema_editor.execute(
+        f"ALTER TABLE {OFFER_VIEW_TABLE} ADD FOREIGN KEY (offer_id) REFERENCES client_offermodel (uuid) DEFERRABLE INITIALLY DEFERRED")
+    schema_editor.execute(
+        f"ALTER TABLE {OFFER_VIEW_TABLE} ADD FOREIGN KEY (user_id) REFERENCES client_profilemodel (uuid) DEFERRABLE INITIALLY DEFERRED")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(date_time) FROM {OFFER_VIEW_TABLE}_old")
+        first_date_time = cursor.fetchone()[0] or timezone.now()
+
+    month = first_date_time.date().replace(day=1)
+    last_month = timezone.now().date().replace(day=1)
+    for _ in range(settings.OFFER_VIEW_PARTITIONS_AHEAD):
+        last_month = get_next_month(last_month)
+    while month <= last_month:
+        schema_editor.execute(
+            f"CREATE TABLE {OFFER_VIEW_TABLE}_y{month.year}m{month.month:02d} PARTITION OF {OFFER_VIEW_TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{get_next_month(month).isoformat()} 00:00:00+00')")
+        month = get_next_month(month)
+
+    schema_editor.execute(f"INSERT INTO {OFFER_VIEW_TABLE} SELECT * FROM {OFFER_VIEW_TABLE}_old")
+    schema_editor.execute(f"DROP TABLE {OFFER_VIEW_TABLE}_old")
+
+
+def unpartition_offer_views(apps, schema_editor):
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE} RENAME TO {OFFER_VIEW_TABLE}_partitioned")
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE}_partitioned RENAME CONSTRAINT {OFFER_VIEW_TABLE}_pkey TO {OFFER_VIEW_TABLE}_partitioned_pkey")
+    schema_editor.execute(f"CREATE TABLE {OFFER_VIEW_TABLE} (LIKE {OFFER_VIEW_TABLE}_partitioned INCLUDING DEFAULTS)")
+    schema_editor.execute(f"ALTER TABLE {OFFER_VIEW_TABLE} ADD PRIMARY KEY (uuid)")
+    schema_editor.execute(
+        f"ALTER TABLE {OFFER_VIEW_TABLE} ADD FOREIGN KEY (offer_id) REFERENCES client_offermodel (uuid) DEFERRABLE INITIALLY DEFERRED")
+    schema_editor.execute(
+        f"ALTER TABLE {OFFER_VIEW_TABLE} ADD FOREIGN KEY (user_id) REFERENCES client_profilemodel (uuid) DEFERRABLE INITIALLY DEFERRED")
+    schema_editor.execute(f"INSERT INTO {OFFER_VIEW_TABLE} SELECT * FROM {OFFER_VIEW_TABLE}_partitioned")
+    schema_editor.execute(f"DROP TABLE {OFFER_VIEW_TABLE}_partitioned")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0028_offer_view_date_time'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offerviewmodel',
+            name='offer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='client.offermodel'),
+        ),
+        migrations.AlterField(
+            model_name='offerviewmodel',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(partition_offer_views, unpartition_offer_views),
+        migrations.AddIndex(
+            model_name='offerviewmodel',
+            index=models.Index(fields=['user', 'date_time'], name='client_offe_user_id_9d1c25_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offerviewmodel',
+            index=models.Index(fields=['offer', 'user'], name='client_offe_offer_i_63dd86_idx'),
+        ),
+    ]
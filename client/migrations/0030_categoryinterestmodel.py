@@ -0,0 +1,52 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:34
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def count_category_interests(apps, schema_editor):
+    OfferViewModel = apps.get_model('client', 'OfferViewModel')
+    CategoryInterestModel = apps.get_model('client', 'CategoryInterestModel')
+
+    category_interests = (
+        OfferViewModel.objects.filter(offer__product__categories__isnull=False)
+        .values_list('user_id', 'offer__product__categories')
+        .annotate(view_count=Count('uuid'), last_viewed=Max('date_time'))
+        .order_by()
+    )
+    CategoryInterestModel.objects.bulk_create(
+        (
+            CategoryInterestModel(user_id=user_uuid, category_id=category_uuid, view_count=view_count, last_viewed=last_viewed)
+            for user_uuid, category_uuid, view_count, last_viewed in category_interests.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0029_offer_view_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryInterestModel',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('view_count', models.PositiveIntegerField(default=0)),
+                ('last_viewed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='client.categorymodel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'view_count'], name='client_cate_categor_ae1eae_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'category'), name='unique_category_interest')],
+            },
+        ),
+        migrations.RunPython(count_category_interests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:02
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncMonth
+
+
+def delete_category_interests(apps, schema_editor):
+    # Lifetime counters cannot be split into months, the buckets are counted again from the view log instead
+    CategoryInterestModel = apps.get_model('client', 'CategoryInterestModel')
+    CategoryInterestModel.objects.all().delete()
+
+
+def count_category_interests(apps, schema_editor):
+    OfferViewModel = apps.get_model('client', 'OfferViewModel')
+    CategoryInterestModel = apps.get_model('client', 'CategoryInterestModel')
+
+    category_interests = (
+        OfferViewModel.objects.filter(offer__product__categories__isnull=False)
+        .annotate(month=TruncMonth('date_time', output_field=DateField(), tzinfo=datetime.UTC))
+        .values_list('user_id', 'offer__product__categories', 'month')
+        .annotate(view_count=Count('uuid'))
+        .order_by()
+    )
+    CategoryInterestModel.objects.bulk_create(
+        (
+            CategoryInterestModel(user_id=user_uuid, category_id=category_uuid, month=month, view_count=view_count)
+            for user_uuid, category_uuid, month, view_count in category_interests.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0030_categoryinterestmodel'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_category_interests, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='categoryinterestmodel',
+            name='unique_category_interest',
+        ),
+        migrations.RemoveIndex(
+            model_name='categoryinterestmodel',
+            name='client_cate_categor_ae1eae_idx',
+        ),
+        migrations.RemoveField(
+            model_name='categoryinterestmodel',
+            name='last_viewed',
+        ),
+        migrations.AddField(
+            model_name='categoryinterestmodel',
+            name='month',
+            field=models.DateField(default=datetime.date(2026, 10, 1)),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='categoryinterestmodel',
+            index=models.Index(fields=['category', 'month'], name='client_cate_categor_ab10b9_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='categoryinterestmodel',
+            constraint=models.UniqueConstraint(fields=('user', 'category', 'month'), name='unique_category_interest_month'),
+        ),
+        migrations.RunPython(count_category_interests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0031_category_interest_months'),
+    ]
+
+    operations = [
+        # Sequence numbers are taken in update order rather than commit order, versions now come from transaction ids;
+        # clients reload their stock maps in full after this, so the old numbers are reset below any transaction id
+        migrations.AlterField(
+            model_name='offermodel',
+            name='stock_version',
+            field=models.BigIntegerField(db_default=models.Func(template='pg_current_xact_id()::text::bigint', output_field=models.BigIntegerField())),
+        ),
+        migrations.AlterField(
+            model_name='productstockmodel',
+            name='version',
+            field=models.BigIntegerField(db_default=models.Func(template='pg_current_xact_id()::text::bigint', output_field=models.BigIntegerField())),
+        ),
+        migrations.RunSQL(
+            sql=[
+                "UPDATE client_productstockmodel SET version = 0;",
+                "UPDATE client_offermodel SET stock_version = 0;",
+                "DROP SEQUENCE client_stock_version_seq;",
+            ],
+            reverse_sql="CREATE SEQUENCE client_stock_version_seq;",
+        ),
+        migrations.CreateModel(
+            name='StockTombstoneModel',
+            fields=[
+                ('uuid', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('offer', 'Offer'), ('product', 'Product')], max_length=10)),
+                ('version', models.BigIntegerField(db_default=models.Func(template='pg_current_xact_id()::text::bigint', output_field=models.BigIntegerField()))),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['version'], name='client_stoc_version_5b2f08_idx')],
+            },
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.utils import timezone
 from django.urls import reverse
 from django_prose_editor.fields import ProseEditorField
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from phonenumber_field.modelfields import PhoneNumberField
 
 ORDER_STATUS = [
@@ -17,6 +19,8 @@ ORDER_STATUS = [
     (6, "Cancelled")
 ]
 
+ORDER_STATUS_CANCELLED = 6
+
 PROFILE_FIELDS = [
     "email",
     "username",
@@ -39,6 +43,19 @@ PROFILE_FIELDS = [
     "date_joined"
 ]
 
+STOCK_TOMBSTONE_KINDS = [
+    ("offer", "Offer"),
+    ("product", "Product")
+]
+
+STOCK_VERSION_SQL = "pg_current_xact_id()::text::bigint"
+
+
+def next_stock_version():
+    # Stock changes are versioned with the id of the transaction writing them, so a change can be told apart from those
+    # of transactions still running when a client reads the stock; a plain Func keeps migrations free of this module
+    return models.Func(template=STOCK_VERSION_SQL, output_field=models.BigIntegerField())
+
 
 class ProfileModel(AbstractUser):
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -134,6 +151,10 @@ class ProductModel(models.Model):
     description = models.TextField(blank=True, max_length=100)
     details = ProseEditorField(blank=True)
     categories = models.ManyToManyField(CategoryModel)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"])]
 
     def get_uuid_display(self):
         return self.name
@@ -170,10 +191,23 @@ class StockModel(models.Model):
     reception_date = models.DateTimeField()
     expiration_date = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["product", "expiration_date"])]
+
     def get_product_display(self):
         return self.product.get_uuid_display()
 
 
+class ProductStockModel(models.Model):
+    product = models.OneToOneField(ProductModel, on_delete=models.CASCADE, primary_key=True, related_name="stock")
+    quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_changed = models.DateTimeField(auto_now=True)
+    version = models.BigIntegerField(db_default=next_stock_version())
+
+    class Meta:
+        indexes = [models.Index(fields=["version"])]
+
+
 class OfferModel(models.Model):
     uuid = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False)
@@ -182,6 +216,10 @@ class OfferModel(models.Model):
     discount = models.DecimalField(max_digits=10, decimal_places=3, default=0)
     currency = models.ForeignKey(CurrencyModel, on_delete=models.PROTECT)
     last_changed = models.DateTimeField(auto_now=True)
+    stock_version = models.BigIntegerField(db_default=next_stock_version())
+
+    class Meta:
+        indexes = [models.Index(fields=["stock_version"])]
 
     def get_price(self, currency_conversion):
         return f"{self.price * currency_conversion.rate:.2f}"
@@ -193,12 +231,60 @@ class OfferModel(models.Model):
         return reverse("offer-view", kwargs={"offer_uuid": self.uuid})
 
 
+class StockTombstoneModel(models.Model):
+    # Deleted offers and products, so clients holding an older stock version drop them from their maps
+    uuid = models.UUIDField(primary_key=True, editable=False)
+    kind = models.CharField(max_length=10, choices=STOCK_TOMBSTONE_KINDS)
+    version = models.BigIntegerField(db_default=next_stock_version())
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["version"])]
+
+
+class OfferPriceModel(models.Model):
+    offer = models.ForeignKey(OfferModel, on_delete=models.CASCADE, related_name="prices")
+    currency = models.ForeignKey(CurrencyModel, on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    price_discounted = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["offer", "currency"], name="unique_offer_price_currency")]
+        indexes = [
+            models.Index(fields=["currency", "price"]),
+            models.Index(fields=["currency", "price_discounted"])
+        ]
+
+
 class OfferViewModel(models.Model):
     uuid = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False)
-    offer = models.ForeignKey(OfferModel, on_delete=models.PROTECT)
-    user = models.ForeignKey(ProfileModel, on_delete=models.PROTECT)
-    date_time = models.DateTimeField(auto_now_add=True)
+    # The table is partitioned by month on date_time, the composite indexes below cover both foreign keys
+    offer = models.ForeignKey(OfferModel, on_delete=models.PROTECT, db_index=False)
+    user = models.ForeignKey(ProfileModel, on_delete=models.PROTECT, db_index=False)
+    # Views are saved in batches after the fact, so the time comes from the buffered event
+    date_time = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "date_time"]),
+            models.Index(fields=["offer", "user"])
+        ]
+
+
+class CategoryInterestModel(models.Model):
+    # Offer views counted per user, category and month as they are flushed, so promotions are targeted with one indexed
+    # query over the months still retained; buckets are dropped together with the offer view partitions of their month
+    uuid = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(ProfileModel, on_delete=models.CASCADE)
+    category = models.ForeignKey(CategoryModel, on_delete=models.CASCADE)
+    month = models.DateField()
+    view_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "category", "month"], name="unique_category_interest_month")]
+        indexes = [models.Index(fields=["category", "month"])]
 
 
 class PromotionModel(models.Model):
@@ -231,9 +317,22 @@ class OrderModel(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.ForeignKey(CurrencyModel, on_delete=models.PROTECT)
+    # Stored when the order is placed, so listing orders does not need to read their lines
+    line_count = models.PositiveIntegerField(default=0)
+    item_summary = models.CharField(max_length=200, default="", blank=True)
+    idempotency_key = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "idempotency_key"], name="unique_order_idempotency_key")]
 
 class OrderOfferModel(models.Model):
     order = models.ForeignKey(OrderModel, on_delete=models.PROTECT)
     offer = models.ForeignKey(OfferModel, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class OrderOfferStockModel(models.Model):
+    order_offer = models.ForeignKey(OrderOfferModel, on_delete=models.CASCADE, related_name="stocks")
+    stock = models.ForeignKey(StockModel, on_delete=models.PROTECT)
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction, IntegrityError, OperationalError
+from django.db.models import F
+from django.utils.text import Truncator
+from .models import OfferModel, OrderModel, OrderOfferModel, OrderOfferStockModel, StockModel
+from .pricing import get_offer_prices
+from .push import publish_product_stocks_on_commit
+from .stock import reserve_product_stocks, allocate_stocks, adjust_product_stock, is_sellable
+
+LOCK_NOT_AVAILABLE_SQLSTATE = "55P03"
+
+ORDER_ITEM_SUMMARY_NAMES = 3
+
+
+class StockContentionError(Exception):
+    pass
+
+
+def set_lock_timeout():
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout = %s", [f"{settings.CHECKOUT_LOCK_TIMEOUT_MS}ms"])
+
+
+def get_order_item_summary(product_names):
+    summary = ", ".join(product_names[:ORDER_ITEM_SUMMARY_NAMES])
+    if len(product_names) > ORDER_ITEM_SUMMARY_NAMES:
+        summary += f" and {len(product_names) - ORDER_ITEM_SUMMARY_NAMES} more"
+    return Truncator(summary).chars(OrderModel._meta.get_field("item_summary").max_length)
+
+
+def place_order(user, currency, offer_quantities, idempotency_key=None):
+    if any(quantity <= 0 for quantity in offer_quantities.values()):
+        raise ValueError("Ordered quantities must be positive!")
+
+    offers = list(OfferModel.objects.select_related("product").filter(uuid__in=offer_quantities.keys()))
+    if len(offers) != len(offer_quantities):
+        raise OfferModel.DoesNotExist("Some of the ordered offers do not exist!")
+    offer_prices = get_offer_prices(offers, currency)
+
+    order = OrderModel(
+        user=user,
+        full_address=user.get_full_address(),
+        phone_number=user.phone_number,
+        currency=currency,
+        total_price=0,
+        line_count=len(offers),
+        item_summary=get_order_item_summary([offer.product.name for offer in offers]),
+        idempotency_key=idempotency_key
+    )
+
+    order_offers = []
+    product_quantities = {}
+    for offer in offers:
+        quantity = offer_quantities[str(offer.uuid)]
+        price = offer_prices[offer.uuid].price_discounted
+        order.total_price += price * quantity
+
+        order_offers.append(OrderOfferModel(order=order, offer=offer, quantity=quantity, price=price))
+        product_quantities[offer.product_id] = product_quantities.get(offer.product_id, 0) + quantity
+
+    try:
+        with transaction.atomic():
+            set_lock_timeout()
+            reserve_product_stocks(product_quantities)
+            order.save()
+            OrderOfferModel.objects.bulk_create(order_offers)
+            allocate_stocks(order_offers)
+            publish_product_stocks_on_commit(product_quantities.keys())
+    except OperationalError as error:
+        # Only lock timeouts are expected here, anything else is a genuine database failure
+        if getattr(error.__cause__, "pgcode", None) != LOCK_NOT_AVAILABLE_SQLSTATE:
+            raise
+        raise StockContentionError("Too many concurrent checkouts for these products, please try again!") from error
+
+    return order
+
+
+# Cancellation
+
+
+def release_order_stocks(order_uuid):
+    # A cancelled order gives back what it drew from each lot, and the part of it still sellable to the product summaries
+    with transaction.atomic():
+        order_offer_stocks = list(OrderOfferStockModel.objects.select_related("stock").filter(order_offer__order_id=order_uuid))
+
+        product_quantities, stock_quantities = {}, {}
+        for order_offer_stock in order_offer_stocks:
+            stock = order_offer_stock.stock
+            stock_quantities[stock.uuid] = stock_quantities.get(stock.uuid, 0) + order_offer_stock.quantity
+            if is_sellable(stock):
+                product_quantities[stock.product_id] = product_quantities.get(stock.product_id, 0) + order_offer_stock.quantity
+
+        # Summaries are locked before lots and in the same order as checkouts, so a release cannot deadlock with them
+        for product_uuid in sorted(product_quantities.keys()):
+            adjust_product_stock(product_uuid, product_quantities[product_uuid])
+        for stock_uuid in sorted(stock_quantities.keys()):
+            StockModel.objects.filter(uuid=stock_uuid).update(quantity=F("quantity") + stock_quantities[stock_uuid])
+        OrderOfferStockModel.objects.filter(order_offer__order_id=order_uuid).delete()
+        publish_product_stocks_on_commit(product_quantities.keys())
+
+
+def reserve_order_stocks(order_uuid):
+    # An order taken back from cancellation needs its stock again, and fails like a checkout when it is gone
+    with transaction.atomic():
+        order_offers = list(OrderOfferModel.objects.select_related("offer").filter(order_id=order_uuid))
+        product_quantities = {}
+        for order_offer in order_offers:
+            product_quantities[order_offer.offer.product_id] = product_quantities.get(order_offer.offer.product_id, 0) + order_offer.quantity
+        reserve_product_stocks(product_quantities)
+        allocate_stocks(order_offers)
+        publish_product_stocks_on_commit(product_quantities.keys())
+
+
+# Idempotency
+
+
+def get_checkout_idempotency_key(user, idempotency_key):
+    return f"checkout:idempotency:{user.pk}:{idempotency_key}"
+
+
+def get_idempotent_order_uuid(user, idempotency_key):
+    return OrderModel.objects.filter(user=user, idempotency_key=idempotency_key).values_list("uuid", flat=True).first()
+
+
+def place_order_once(user, currency, offer_quantities, idempotency_key=None):
+    # Returns the uuid of the order and whether it was placed now, repeated submissions get the original order back
+    if idempotency_key is None:
+        return place_order(user, currency, offer_quantities).uuid, True
+
+    cache_key = get_checkout_idempotency_key(user, idempotency_key)
+    order_uuid = cache.get(cache_key) or get_idempotent_order_uuid(user, idempotency_key)
+    if order_uuid is not None:
+        return order_uuid, False
+
+    try:
+        order = place_order(user, currency, offer_quantities, idempotency_key)
+    except IntegrityError:
+        # A concurrent submission with the same key committed first, its reservation stands and ours was rolled back
+        order_uuid = get_idempotent_order_uuid(user, idempotency_key)
+        if order_uuid is None:
+            raise
+        return order_uuid, False
+
+    transaction.on_commit(lambda: cache.set(cache_key, order.uuid, timeout=settings.CHECKOUT_IDEMPOTENCY_TTL), robust=True)
+    return order.uuid, True
@@ -0,0 +1,100 @@
+from decimal import ROUND_HALF_UP, Decimal
+from typing import NamedTuple
+from django.db.models import Case, DecimalField, F, FilteredRelation, Q, Value, When
+from django.db.models.functions import Coalesce, Round
+from .models import CurrencyModel, CurrencyConversionModel, OfferModel, OfferPriceModel
+from .push import publish_offer_prices_on_commit
+from .rates import get_currency_rates
+from .utils import chunked
+
+PRICE_QUANTUM = Decimal("0.01")
+OFFER_PRICES_REFRESH_BATCH_SIZE = 1000
+
+
+class OfferPrice(NamedTuple):
+    price: Decimal
+    price_discounted: Decimal
+
+
+def get_conversion_rates(source_currency_uuids, destination_currency: CurrencyModel):
+    currency_rates = get_currency_rates()
+    rates = {
+        source_currency_uuid: currency_rates.get_rate(source_currency_uuid, destination_currency.uuid)
+        for source_currency_uuid in set(source_currency_uuids)
+    }
+
+    missing_currency_uuids = [source_currency_uuid for source_currency_uuid, rate in rates.items() if rate is None]
+    if missing_currency_uuids:
+        raise CurrencyConversionModel.DoesNotExist(
+            f"No conversion rate to {destination_currency.code} for currencies: {', '.join(str(uuid) for uuid in missing_currency_uuids)}")
+    return rates
+
+
+def get_offer_price(offer, rate):
+    price = offer.price * rate
+    price_discounted = price * (1 - offer.discount)
+    # Rounded half up like ROUND() in the database, so stored and fallback prices agree to the cent
+    return OfferPrice(price.quantize(PRICE_QUANTUM, ROUND_HALF_UP), price_discounted.quantize(PRICE_QUANTUM, ROUND_HALF_UP))
+
+
+def get_offer_prices(offers, currency: CurrencyModel):
+    offers = list(offers)
+    rates = get_conversion_rates([offer.currency_id for offer in offers], currency)
+    return {offer.uuid: get_offer_price(offer, rates[offer.currency_id]) for offer in offers}
+
+
+def annotate_offer_prices(offers, currency: CurrencyModel):
+    # Offers whose price rows are not written yet are priced from the current rates in the query itself,
+    # so they are listed, filtered and ordered like the rest; offers with no rate to the currency are left out
+    currency_rates = get_currency_rates()
+    rates = [
+        When(currency_id=source_currency_uuid, then=Value(rate))
+        for source_currency_uuid in CurrencyModel.objects.values_list("uuid", flat=True)
+        if (rate := currency_rates.get_rate(source_currency_uuid, currency.uuid)) is not None
+    ]
+    rate = Case(*rates, default=Value(None), output_field=DecimalField(max_digits=24, decimal_places=12))
+    return offers.annotate(
+        currency_price=FilteredRelation("prices", condition=Q(prices__currency=currency)),
+        offer_price=Coalesce(F("currency_price__price"), Round(F("price") * rate, 2), output_field=DecimalField()),
+        offer_price_discounted=Coalesce(
+            F("currency_price__price_discounted"), Round(F("price") * rate * (1 - F("discount")), 2), output_field=DecimalField()),
+    ).filter(offer_price__isnull=False)
+
+
+def refresh_missing_offer_prices():
+    return refresh_offer_prices(OfferModel.objects.filter(prices__isnull=True))
+
+
+def refresh_offer_prices(offers=None):
+    offers = OfferModel.objects.all() if offers is None else offers
+    currency_rates = get_currency_rates()
+    destination_currency_uuids = currency_rates.get_destination_currency_uuids()
+    currency_codes = dict(CurrencyModel.objects.filter(uuid__in=destination_currency_uuids).values_list("uuid", "code"))
+
+    offer_rows = offers.order_by("uuid").values_list("uuid", "price", "discount", "currency_id", named=True)
+    refreshed_count = 0
+    for offer_rows_batch in chunked(offer_rows.iterator(chunk_size=OFFER_PRICES_REFRESH_BATCH_SIZE), OFFER_PRICES_REFRESH_BATCH_SIZE):
+        offer_prices = []
+        offer_currency_prices = {}
+        for offer_row in offer_rows_batch:
+            for destination_uuid in destination_currency_uuids:
+                rate = currency_rates.get_rate(offer_row.currency_id, destination_uuid)
+                if rate is None:
+                    continue
+                offer_price = get_offer_price(offer_row, rate)
+                offer_currency_prices.setdefault(offer_row.uuid, {})[currency_codes[destination_uuid]] = offer_price
+                offer_prices.append(OfferPriceModel(
+                    offer_id=offer_row.uuid,
+                    currency_id=destination_uuid,
+                    price=offer_price.price,
+                    price_discounted=offer_price.price_discounted
+                ))
+        OfferPriceModel.objects.bulk_create(
+            offer_prices,
+            update_conflicts=True,
+            unique_fields=["offer", "currency"],
+            update_fields=["price", "price_discounted"]
+        )
+        publish_offer_prices_on_commit(offer_currency_prices)
+        refreshed_count += len(offer_prices)
+    return refreshed_count
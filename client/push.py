@@ -0,0 +1,140 @@
+import json
+import asyncio
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from .models import ProductStockModel
+
+OFFER_CHANGES_CHANNEL = "push:offer-changes"
+PUSH_KEEPALIVE_SECONDS = 20
+PUSH_RECONNECT_SECONDS = 1
+PUSH_CLIENT_RETRY_MILLISECONDS = 5000
+PUSH_QUEUE_SIZE = 100
+
+logger = logging.getLogger('django')
+
+
+def get_product_key(product_uuid):
+    return f"product:{product_uuid}"
+
+
+def get_offer_key(offer_uuid):
+    return f"offer:{offer_uuid}"
+
+
+# Publishing
+
+
+def publish_changes(changes):
+    if changes:
+        get_redis_connection("default").publish(
+            OFFER_CHANGES_CHANNEL,
+            json.dumps([{"key": key, "data": data} for key, data in changes], cls=DjangoJSONEncoder)
+        )
+
+
+def publish_product_stocks(product_uuids):
+    product_stocks = ProductStockModel.objects.filter(product_id__in=product_uuids).values_list("product_id", "quantity")
+    publish_changes([
+        (get_product_key(product_uuid), {"type": "stock", "product": str(product_uuid), "quantity": int(quantity)})
+        for product_uuid, quantity in product_stocks
+    ])
+
+
+def publish_product_stocks_on_commit(product_uuids):
+    product_uuids = list(product_uuids)
+    transaction.on_commit(lambda: publish_product_stocks(product_uuids), robust=True)
+
+
+def publish_offer_prices_on_commit(offer_prices):
+    # offer_prices maps each offer to its {currency code: OfferPrice} prices
+    changes = [
+        (get_offer_key(offer_uuid), {"type": "price", "offer": str(offer_uuid), "prices": {
+            currency_code: {"price": offer_price.price, "price_discounted": offer_price.price_discounted}
+            for currency_code, offer_price in currency_prices.items()
+        }})
+        for offer_uuid, currency_prices in offer_prices.items()
+    ]
+    transaction.on_commit(lambda: publish_changes(changes), robust=True)
+
+
+# Broadcasting
+
+
+class ChangesBroadcaster:
+    # One Redis subscription per process fans changes out to the queues of the open streams,
+    # so an idle stream costs a parked coroutine rather than a Redis connection
+
+    def __init__(self):
+        self.subscribers = {}
+        self.listener = None
+
+    def subscribe(self, keys):
+        queue = asyncio.Queue(maxsize=PUSH_QUEUE_SIZE)
+        for key in keys:
+            self.subscribers.setdefault(key, set()).add(queue)
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self.listen())
+        return queue
+
+    def unsubscribe(self, keys, queue):
+        for key in keys:
+            key_subscribers = self.subscribers.get(key)
+            if key_subscribers is not None:
+                key_subscribers.discard(queue)
+                if not key_subscribers:
+                    del self.subscribers[key]
+
+    def dispatch(self, change):
+        for queue in self.subscribers.get(change["key"], ()):
+            try:
+                queue.put_nowait(change["data"])
+            except asyncio.QueueFull:
+                # A stream that cannot keep up is told to reload instead of receiving a partial picture
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    async def listen(self):
+        client = aioredis.from_url(settings.CACHES["default"]["LOCATION"])
+        while True:
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(OFFER_CHANGES_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            for change in json.loads(message["data"]):
+                                self.dispatch(change)
+            except RedisError as error:
+                logger.warning(f"Lost the offer changes subscription, reconnecting: {error}")
+                await asyncio.sleep(PUSH_RECONNECT_SECONDS)
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = ChangesBroadcaster()
+    return _broadcaster
+
+
+async def stream_changes(keys):
+    broadcaster = get_broadcaster()
+    queue = broadcaster.subscribe(keys)
+    try:
+        yield f"retry: {PUSH_CLIENT_RETRY_MILLISECONDS}\n\n"
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=PUSH_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {data['type']}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+    finally:
+        broadcaster.unsubscribe(keys, queue)
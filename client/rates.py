@@ -0,0 +1,71 @@
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from .models import CurrencyModel, CurrencyConversionModel
+
+CURRENCY_RATES_VERSION_KEY = "currency-rates:version"
+
+
+class CurrencyRates:
+    def __init__(self, base_currency_uuid, conversions, version=None):
+        self.base_currency_uuid = base_currency_uuid
+        self.version = version
+
+        # Rates are kept against the base currency, cross rates are derived from them
+        base_rates = {base_currency_uuid: Decimal(1)}
+        for source_uuid, destination_uuid, rate in conversions:
+            if source_uuid == base_currency_uuid:
+                base_rates[destination_uuid] = rate
+        for source_uuid, destination_uuid, rate in conversions:
+            if destination_uuid == base_currency_uuid and source_uuid not in base_rates:
+                base_rates[source_uuid] = 1 / rate
+
+        self.rates = {
+            (source_uuid, destination_uuid): destination_rate / source_rate
+            for source_uuid, source_rate in base_rates.items()
+            for destination_uuid, destination_rate in base_rates.items()
+        }
+        # Explicit pairs still take precedence over derived cross rates
+        for source_uuid, destination_uuid, rate in conversions:
+            self.rates[(source_uuid, destination_uuid)] = rate
+
+    @classmethod
+    def load(cls, version=None):
+        base_currency_uuid = CurrencyModel.objects.filter(code=settings.BASE_CURRENCY_CODE).values_list("uuid", flat=True).first()
+        conversions = list(
+            CurrencyConversionModel.objects.filter(source__isnull=False, destination__isnull=False, rate__gt=0)
+            .values_list("source", "destination", "rate")
+        )
+        for currency_uuid in CurrencyModel.objects.values_list("uuid", flat=True):
+            conversions.append((currency_uuid, currency_uuid, Decimal(1)))
+        return cls(base_currency_uuid, conversions, version)
+
+    def get_rate(self, source_currency_uuid, destination_currency_uuid):
+        return self.rates.get((source_currency_uuid, destination_currency_uuid))
+
+    def get_destination_currency_uuids(self):
+        return {destination_uuid for _source_uuid, destination_uuid in self.rates}
+
+    def convert(self, amounts, source_currency_uuid, destination_currency_uuid):
+        rate = self.rates[(source_currency_uuid, destination_currency_uuid)]
+        return [amount * rate for amount in amounts]
+
+
+_currency_rates = None
+
+
+def get_currency_rates():
+    global _currency_rates
+    version = cache.get(CURRENCY_RATES_VERSION_KEY)
+    if _currency_rates is None or version is None or _currency_rates.version != version:
+        if version is None:
+            version = invalidate_currency_rates()
+        _currency_rates = CurrencyRates.load(version)
+    return _currency_rates
+
+
+def invalidate_currency_rates():
+    version = uuid.uuid4().hex
+    cache.set(CURRENCY_RATES_VERSION_KEY, version, timeout=None)
+    return version
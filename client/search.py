@@ -0,0 +1,32 @@
+import re
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+
+SEARCH_CONFIG = "english"
+
+
+def get_product_search_vector():
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG) +
+        SearchVector("description", weight="B", config=SEARCH_CONFIG) +
+        SearchVector("details", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def get_search_query(text):
+    terms = re.findall(r"\w+", text or "")
+    if not terms:
+        return None
+    return SearchQuery(" & ".join(f"{term}:*" for term in terms), search_type="raw", config=SEARCH_CONFIG)
+
+
+def search_products(queryset, text, product_field=None):
+    search_vector_field = f"{product_field}__search_vector" if product_field else "search_vector"
+    search_query = get_search_query(text)
+    if search_query is None:
+        return queryset
+    # Ranks are read as double precision, so a rank carried in a pagination cursor compares equal to itself
+    return queryset.filter(**{search_vector_field: search_query}).annotate(
+        search_rank=Cast(SearchRank(F(search_vector_field), search_query), FloatField())
+    ).order_by("-search_rank", *queryset.query.order_by)
@@ -0,0 +1,88 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import ORDER_STATUS_CANCELLED, ProductModel, StockModel, OrderModel, ProductStockModel, OfferModel, CurrencyModel, CurrencyConversionModel, next_stock_version
+from .orders import release_order_stocks, reserve_order_stocks
+from .push import publish_product_stocks_on_commit
+from .rates import invalidate_currency_rates
+from .stock import adjust_product_stock, get_sellable_quantity, bury_stock_entries
+from .tasks import update_offer_prices
+
+
+@receiver(post_save, sender=OfferModel)
+def refresh_offer_prices_on_offer_change(sender, instance, **kwargs):
+    offer_uuids = [str(instance.uuid)]
+    transaction.on_commit(lambda: update_offer_prices.delay(offer_uuids=offer_uuids))
+
+
+@receiver(post_save, sender=OfferModel)
+def update_offer_stock_version(sender, instance, created, **kwargs):
+    # New offers take a version on insert, edited ones may have moved to another product
+    if not created:
+        OfferModel.objects.filter(uuid=instance.uuid).update(stock_version=next_stock_version())
+
+
+@receiver(post_delete, sender=OfferModel)
+def bury_offer_stock(sender, instance, **kwargs):
+    bury_stock_entries("offer", [instance.uuid])
+
+
+@receiver(post_delete, sender=ProductModel)
+def bury_product_stock(sender, instance, **kwargs):
+    bury_stock_entries("product", [instance.uuid])
+
+
+@receiver([post_save, post_delete], sender=CurrencyConversionModel)
+def refresh_offer_prices_on_rate_change(sender, instance, **kwargs):
+    # Every cross rate may depend on the changed one, so every offer price is refreshed
+    transaction.on_commit(invalidate_currency_rates)
+    transaction.on_commit(update_offer_prices.delay)
+
+
+@receiver([post_save, post_delete], sender=CurrencyModel)
+def invalidate_currency_rates_on_currency_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_currency_rates)
+
+
+@receiver(post_save, sender=ProductModel)
+def create_product_stock(sender, instance, created, **kwargs):
+    if created:
+        ProductStockModel.objects.get_or_create(product=instance)
+
+
+@receiver(pre_save, sender=StockModel)
+def remember_previous_stock(sender, instance, **kwargs):
+    instance._previous_stock = StockModel.objects.filter(uuid=instance.uuid).first()
+
+
+@receiver(post_save, sender=StockModel)
+def update_product_stock_on_stock_save(sender, instance, **kwargs):
+    previous_stock = getattr(instance, "_previous_stock", None)
+    product_uuids = {instance.product_id}
+    if previous_stock is not None:
+        adjust_product_stock(previous_stock.product_id, -get_sellable_quantity(previous_stock))
+        product_uuids.add(previous_stock.product_id)
+    adjust_product_stock(instance.product_id, get_sellable_quantity(instance))
+    publish_product_stocks_on_commit(product_uuids)
+
+
+@receiver(post_delete, sender=StockModel)
+def update_product_stock_on_stock_delete(sender, instance, **kwargs):
+    adjust_product_stock(instance.product_id, -get_sellable_quantity(instance))
+    publish_product_stocks_on_commit([instance.product_id])
+
+
+@receiver(pre_save, sender=OrderModel)
+def remember_previous_order_status(sender, instance, **kwargs):
+    instance._previous_status = OrderModel.objects.filter(uuid=instance.uuid).values_list("status", flat=True).first()
+
+
+@receiver(post_save, sender=OrderModel)
+def update_stock_on_order_cancel(sender, instance, created, **kwargs):
+    previous_status = getattr(instance, "_previous_status", None)
+    if created or previous_status is None:
+        return
+    if instance.status == ORDER_STATUS_CANCELLED and previous_status != ORDER_STATUS_CANCELLED:
+        release_order_stocks(instance.uuid)
+    elif instance.status != ORDER_STATUS_CANCELLED and previous_status == ORDER_STATUS_CANCELLED:
+        reserve_order_stocks(instance.uuid)
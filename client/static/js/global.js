@@ -244,8 +244,57 @@ const fetchCurrencyData = async () => {
 let stockData = null;
 
 const fetchStockData = async () => {
-  const response = await fetchData("GET", stockListOffersUrl, null);
-  stockData = response;
+  const cachedStockData = JSON.parse(sessionStorage.getItem("stockCache"));
+  stockData = cachedStockData;
+
+  // Only the entries changed or deleted since the cached version are sent back, or nothing at all
+  const url = new URL(stockListOffersUrl, window.location.origin);
+  const headers = {
+    Accept: "application/json",
+    "X-Requested-With": "XMLHttpRequest",
+  };
+  if (cachedStockData !== null) {
+    url.searchParams.set("version", cachedStockData.version);
+    headers["If-None-Match"] = cachedStockData.etag;
+  }
+
+  try {
+    const response = await fetch(url, {
+      method: "GET",
+      credentials: "same-origin",
+      headers: headers,
+    });
+    if (response.status === 304) {
+      return;
+    }
+    const stockDataDelta = await response.json();
+    const previousStockData = stockDataDelta.full
+      ? { product_stock: {}, offer_product: {} }
+      : cachedStockData;
+    const productStock = {
+      ...previousStockData.product_stock,
+      ...stockDataDelta.product_stock,
+    };
+    const offerProduct = {
+      ...previousStockData.offer_product,
+      ...stockDataDelta.offer_product,
+    };
+    for (const productUuid of stockDataDelta.deleted_products) {
+      delete productStock[productUuid];
+    }
+    for (const offerUuid of stockDataDelta.deleted_offers) {
+      delete offerProduct[offerUuid];
+    }
+    stockData = {
+      version: stockDataDelta.version,
+      etag: response.headers.get("ETag"),
+      product_stock: productStock,
+      offer_product: offerProduct,
+    };
+    sessionStorage.setItem("stockCache", JSON.stringify(stockData));
+  } catch (exception) {
+    console.log(exception);
+  }
 };
 
 const getCartOfferUuids = () => {
@@ -14,7 +14,8 @@ $(document).ready(async function () {
 
   if (window.location.pathname === cartUrl) {
     await fetchStockData();
-    loadCart();
+    await loadCart();
+    watchCartOffers();
   }
 });
 
@@ -259,6 +260,7 @@ const loadCart = async () => {
     generateEmptyCartAlert();
 
     cartData = {};
+    totalPrice = 0;
     for (const offer of response.offers) {
       cartData[offer.uuid] = offer;
       const offerCartQuantity = Number(localStorage.getItem(offer.uuid));
@@ -407,6 +409,67 @@ const loadCart = async () => {
   }
 };
 
+let cartOffersEventSource = null;
+
+const watchCartOffers = () => {
+  if (cartOffersEventSource !== null) {
+    cartOffersEventSource.close();
+  }
+  const offerUuids = getCartOfferUuids();
+  if (offerUuids.length === 0) {
+    return;
+  }
+
+  let url = new URL(stockWatchOffersUrl, window.location.origin);
+  url.searchParams.set("offers", offerUuids.join(","));
+  cartOffersEventSource = new EventSource(url.toString());
+
+  // Changes made while the stream was (re)connecting are caught up on
+  cartOffersEventSource.onopen = async () => {
+    await fetchStockData();
+  };
+
+  cartOffersEventSource.addEventListener("stock", (event) => {
+    const change = JSON.parse(event.data);
+    stockData.product_stock[change.product] = change.quantity;
+    sessionStorage.setItem("stockCache", JSON.stringify(stockData));
+    if (getCartProductQuantity(change.product) > change.quantity) {
+      createToast(
+        "Some items in your cart are <strong>no longer in stock</strong> in the requested quantity!",
+        "warning"
+      );
+    }
+  });
+
+  cartOffersEventSource.addEventListener("price", (event) => {
+    const change = JSON.parse(event.data);
+    const offerPrice = change.prices[currency];
+    if (offerPrice === undefined || !(change.offer in cartData)) {
+      return;
+    }
+
+    const offerCartQuantity = Number(localStorage.getItem(change.offer));
+    totalPrice +=
+      (Number(offerPrice.price_discounted) -
+        Number(cartData[change.offer].price_discounted)) *
+      offerCartQuantity;
+    cartData[change.offer].price = offerPrice.price;
+    cartData[change.offer].price_discounted = offerPrice.price_discounted;
+
+    const offerPriceTotal =
+      Number(offerPrice.price_discounted) * offerCartQuantity;
+    $(`#cart-price-${change.offer}`).text(
+      `${offerPriceTotal.toFixed(2)} ${currency}`
+    );
+    $("#cart-total-price").text(`${totalPrice.toFixed(2)} ${currency}`);
+  });
+
+  cartOffersEventSource.addEventListener("resync", async () => {
+    await fetchStockData();
+    await loadCart();
+  });
+};
+
 const purchase = async () => {
   let data = [];
   const offerUuids = getCartOfferUuids();
@@ -418,13 +481,25 @@ const purchase = async () => {
     data.push(offerOrder);
   }
 
+  // The key is kept until the order goes through, so double clicks and retries are placed only once
+  let idempotencyKey = sessionStorage.getItem("checkoutIdempotencyKey");
+  if (idempotencyKey === null) {
+    idempotencyKey = crypto.randomUUID();
+    sessionStorage.setItem("checkoutIdempotencyKey", idempotencyKey);
+  }
+
   const response = await fetchData(
     "POST",
     addOrderUrl,
-    JSON.stringify({ offers: data, currency: currency })
+    JSON.stringify({
+      offers: data,
+      currency: currency,
+      idempotencyKey: idempotencyKey,
+    })
   );
 
   if (response.success) {
+    sessionStorage.removeItem("checkoutIdempotencyKey");
     clearCart();
   } else {
     // replace with toast
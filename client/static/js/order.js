@@ -29,7 +29,13 @@ async function fetchOrders() {
       const offersColumn = $("<div></div>").addClass("col col-md-7");
       const offersList = $("<ul></ul>").addClass("list-group list-group-flush");
 
-      for (const offer of order.offers) {
+      if (order.offers === undefined) {
+        const summaryListItem = $("<li></li>")
+          .addClass("list-group-item")
+          .text(`${order.itemSummary} (${order.lineCount} items)`);
+        offersList.append(summaryListItem);
+      }
+      for (const offer of order.offers ?? []) {
         const offerListItem = $("<li></li>")
           .addClass("list-group-item d-flex flex-row")
           .attr("id", offer.offerUuid);
@@ -62,10 +68,14 @@ async function fetchOrders() {
       const orderStatus = $("<h6></h6>").text(`Status: ${order.status}`);
 
       const orderInvoice = $("<h6></h6>").text("Invoice: ");
-      const orderInvoiceLink = $("<a></a>")
-        .attr("href", order.invoice)
-        .text(order.invoice.substr(order.invoice.lastIndexOf("/") + 1));
-      orderInvoice.append(orderInvoiceLink);
+      if (order.invoice !== null) {
+        const orderInvoiceLink = $("<a></a>")
+          .attr("href", order.invoice)
+          .text(order.invoice.substr(order.invoice.lastIndexOf("/") + 1));
+        orderInvoice.append(orderInvoiceLink);
+      } else {
+        orderInvoice.append("being generated");
+      }
 
       orderInformation.append(orderPrice);
       orderInformation.append(orderDate);
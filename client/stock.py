@@ -0,0 +1,171 @@
+from decimal import Decimal
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Max, Q, Sum
+from django.db.models.functions import Now
+from django.utils import timezone
+from .models import ProductModel, StockModel, OfferModel, ProductStockModel, OrderOfferStockModel, StockTombstoneModel, next_stock_version
+from .push import publish_product_stocks_on_commit
+from .utils import chunked
+
+STOCK_ALLOCATION_BATCH_SIZE = 100
+
+STOCK_EXPIRY_CHECKED_AT_KEY = "stock:expiry-checked-at"
+STOCK_TOMBSTONES_DELETED_VERSION_KEY = "stock:tombstones-deleted-version"
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_uuids):
+        self.product_uuids = product_uuids
+        super().__init__(f"Not enough stock for products: {', '.join(str(uuid) for uuid in product_uuids)}")
+
+
+def get_sellable_stocks():
+    return StockModel.objects.filter(Q(expiration_date__isnull=True) | Q(expiration_date__gt=Now()))
+
+
+def is_sellable(stock):
+    return stock.expiration_date is None or stock.expiration_date > timezone.now()
+
+
+def get_sellable_quantity(stock):
+    if not is_sellable(stock):
+        return Decimal(0)
+    return stock.quantity
+
+
+def adjust_product_stock(product_uuid, quantity_delta):
+    updated_count = ProductStockModel.objects.filter(product_id=product_uuid).update(
+        quantity=F("quantity") + quantity_delta, last_changed=timezone.now(), version=next_stock_version())
+    if not updated_count:
+        ProductStockModel.objects.get_or_create(product_id=product_uuid)
+        adjust_product_stock(product_uuid, quantity_delta)
+
+
+def get_stock_version():
+    # Transactions older than the oldest one still running have all committed or rolled back, so no change at or below
+    # this version can show up later; newer changes are sent again until the version moves past them
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint - 1")
+        return cursor.fetchone()[0]
+
+
+def get_latest_stock_version():
+    product_stock_version = ProductStockModel.objects.aggregate(version=Max("version"))["version"] or 0
+    offer_stock_version = OfferModel.objects.aggregate(version=Max("stock_version"))["version"] or 0
+    tombstone_version = StockTombstoneModel.objects.aggregate(version=Max("version"))["version"] or 0
+    return max(product_stock_version, offer_stock_version, tombstone_version)
+
+
+def bury_stock_entries(kind, uuids):
+    StockTombstoneModel.objects.bulk_create([StockTombstoneModel(uuid=uuid, kind=kind) for uuid in uuids], ignore_conflicts=True)
+
+
+def get_deleted_stock_version():
+    # Clients older than the last deleted tombstone may have missed a deletion and are sent the whole stock instead
+    return cache.get(STOCK_TOMBSTONES_DELETED_VERSION_KEY, 0)
+
+
+def delete_expired_stock_tombstones(retention_days):
+    expired_tombstones = StockTombstoneModel.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=retention_days))
+    deleted_version = expired_tombstones.aggregate(version=Max("version"))["version"]
+    if deleted_version is None:
+        return 0
+    cache.set(STOCK_TOMBSTONES_DELETED_VERSION_KEY, max(deleted_version, get_deleted_stock_version()), timeout=None)
+    deleted_count, _deleted = expired_tombstones.filter(version__lte=deleted_version).delete()
+    return deleted_count
+
+
+def reserve_product_stocks(product_quantities):
+    # Each conditional update locks its row, so concurrent reservations queue up and re-check the remaining quantity
+    # instead of overselling; updating in a fixed order keeps overlapping carts from deadlocking
+    for product_uuid in sorted(product_quantities.keys()):
+        quantity = product_quantities[product_uuid]
+        reserved_count = ProductStockModel.objects.filter(product_id=product_uuid, quantity__gte=quantity).update(
+            quantity=F("quantity") - quantity, last_changed=timezone.now(), version=next_stock_version())
+        if not reserved_count:
+            raise InsufficientStockError([product_uuid])
+
+
+def allocate_product_stocks(product_uuid, order_offers):
+    # Lots are streamed first-expired-first-out and only as many are read as the order lines need
+    stocks = (
+        get_sellable_stocks()
+        .select_for_update()
+        .filter(product_id=product_uuid, quantity__gt=0)
+        .order_by(F("expiration_date").asc(nulls_last=True), "reception_date", "uuid")
+        .values_list("uuid", "quantity")
+        .iterator(chunk_size=STOCK_ALLOCATION_BATCH_SIZE)
+    )
+
+    order_offer_stocks = []
+    stock_uuid, stock_quantity = None, Decimal(0)
+    for order_offer in order_offers:
+        needed_quantity = Decimal(order_offer.quantity)
+        while needed_quantity > 0:
+            if not stock_quantity:
+                stock_uuid, stock_quantity = next(stocks, (None, Decimal(0)))
+                if stock_uuid is None:
+                    raise InsufficientStockError([product_uuid])
+            drawn_quantity = min(needed_quantity, stock_quantity)
+            stock_quantity -= drawn_quantity
+            needed_quantity -= drawn_quantity
+            order_offer_stocks.append(OrderOfferStockModel(order_offer=order_offer, stock_id=stock_uuid, quantity=drawn_quantity))
+    return order_offer_stocks
+
+
+def allocate_stocks(order_offers):
+    product_order_offers = {}
+    for order_offer in order_offers:
+        product_order_offers.setdefault(order_offer.offer.product_id, []).append(order_offer)
+
+    order_offer_stocks = []
+    for product_uuid in sorted(product_order_offers.keys()):
+        order_offer_stocks += allocate_product_stocks(product_uuid, product_order_offers[product_uuid])
+
+    drawn_quantities = {}
+    for order_offer_stock in order_offer_stocks:
+        drawn_quantities[order_offer_stock.stock_id] = drawn_quantities.get(order_offer_stock.stock_id, 0) + order_offer_stock.quantity
+    for stock_uuid, drawn_quantity in drawn_quantities.items():
+        StockModel.objects.filter(uuid=stock_uuid).update(quantity=F("quantity") - drawn_quantity)
+
+    OrderOfferStockModel.objects.bulk_create(order_offer_stocks, batch_size=STOCK_ALLOCATION_BATCH_SIZE)
+    return order_offer_stocks
+
+
+def get_expected_product_stocks(product_uuids=None):
+    products = ProductModel.objects.all()
+    stocks = get_sellable_stocks()
+    if product_uuids is not None:
+        products = products.filter(uuid__in=product_uuids)
+        stocks = stocks.filter(product_id__in=product_uuids)
+
+    product_stocks = {product_uuid: Decimal(0) for product_uuid in products.values_list("uuid", flat=True)}
+    for product_uuid, quantity in stocks.values_list("product_id").annotate(Sum("quantity")):
+        product_stocks[product_uuid] += quantity
+    return product_stocks
+
+
+def refresh_product_stocks(product_uuids):
+    refreshed_count = 0
+    for product_uuids_batch in chunked(sorted(product_uuids), STOCK_ALLOCATION_BATCH_SIZE):
+        with transaction.atomic():
+            # Holding the summary rows keeps checkouts from reserving while the lots are summed
+            product_stocks = list(ProductStockModel.objects.select_for_update().filter(product_id__in=product_uuids_batch).order_by("product_id"))
+            expected_product_stocks = get_expected_product_stocks(product_uuids_batch)
+            for product_stock in product_stocks:
+                product_stock.quantity = expected_product_stocks[product_stock.product_id]
+                product_stock.last_changed = timezone.now()
+                product_stock.version = next_stock_version()
+            ProductStockModel.objects.bulk_update(product_stocks, ["quantity", "last_changed", "version"])
+            publish_product_stocks_on_commit(product_uuids_batch)
+        refreshed_count += len(product_stocks)
+    return refreshed_count
+
+
+def refresh_expired_product_stocks(expired_since=None):
+    expired_stocks = StockModel.objects.filter(expiration_date__lte=Now(), quantity__gt=0)
+    if expired_since is not None:
+        expired_stocks = expired_stocks.filter(expiration_date__gt=expired_since)
+    return refresh_product_stocks(set(expired_stocks.values_list("product_id", flat=True)))
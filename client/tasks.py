@@ -1,15 +1,29 @@
 from __future__ import absolute_import, unicode_literals
 
+import time
+import json
+import uuid
 import logging
 from datetime import timedelta
-from celery import shared_task, states
+from smtplib import SMTPException
+from celery import shared_task, states, chord
 from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
 from django.db.models.functions import Now
+from django.utils import timezone
+from django.core.cache import cache
 from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection, mail_admins
 from django.template.loader import render_to_string, get_template, TemplateDoesNotExist
-from django_celery_beat.models import PeriodicTask, IntervalSchedule
-from .models import ProfileModel, PromotionModel, OfferModel
+from django_celery_beat.models import PeriodicTask, IntervalSchedule, ClockedSchedule
+from .models import ProfileModel, PromotionModel, OfferModel, OrderModel
+from .invoices import render_order_invoice
+from .pricing import refresh_offer_prices
+from .stock import STOCK_EXPIRY_CHECKED_AT_KEY, refresh_expired_product_stocks, delete_expired_stock_tombstones
+from .interest import buffer_offer_view, flush_buffered_offer_views, get_interested_user_uuids, create_offer_view_partitions, drop_expired_offer_view_partitions, delete_expired_category_interests
+from .utils import chunked, snake_case
+from .discounts import get_category_offers, update_offer_discounts, get_discounts_lock, add_pending_discounts_calculation, pop_pending_discounts_calculation
 
 logger = get_task_logger('django')
 
@@ -56,25 +70,78 @@ def send_email_admins_html(self, content_path, content_data, subject):
 
 
 @shared_task(bind=True, max_retries=3)
-def send_promotion_emails_html(self, content_path, users, promotion, subject):
-    promotion_emails = []
-    for user in users:
-        content_data = {"category_name": promotion.category.name, "expiration_date": promotion.end_date, "discount": promotion.discount * 100, "first_name": user.first_name}
-        content = render_to_string(content_path, content_data)
-        promotion_email = EmailMultiAlternatives(
-            subject=subject,
-            body=content,
-            to=[user.email]
-        )
-        promotion_email.content_subtype = "html"
-        promotion_emails.append(promotion_email)
+def send_promotion_emails_html(self, content_path, user_uuids, promotion_uuid, subject):
+    # Each chunk renders and sends one message at a time over its own connection, so memory does not grow with the recipients
+    promotion = PromotionModel.objects.select_related("category").get(uuid=promotion_uuid)
+    template = get_template(content_path)
+    users = ProfileModel.objects.filter(uuid__in=user_uuids).only("first_name", "email")
 
     connection = get_connection()
-    connection.open()
-    connection.send_messages(promotion_emails)
-    connection.close()
+    try:
+        connection.open()
+    except (SMTPException, OSError) as error:
+        # Nothing has been sent yet, so the whole chunk can be retried safely
+        raise self.retry(exc=error, countdown=60)
+
+    sent_count, failed_count = 0, 0
+    try:
+        for user in users.iterator():
+            content_data = {"category_name": promotion.category.name, "expiration_date": promotion.end_date, "discount": promotion.discount * 100, "first_name": user.first_name}
+            promotion_email = EmailMultiAlternatives(
+                subject=subject,
+                body=template.render(content_data),
+                to=[user.email],
+                connection=connection
+            )
+            promotion_email.content_subtype = "html"
+            try:
+                sent_count += promotion_email.send(fail_silently=False)
+            except (SMTPException, OSError) as error:
+                failed_count += 1
+                logger.warning(f"Could not send the promotion email to {user.email}: {error}")
+    finally:
+        connection.close()
+
+    return {"sent": sent_count, "failed": failed_count}
+
 
-    return True
+@shared_task(bind=True)
+def report_promotion_emails(self, chunk_results, promotion_uuid):
+    sent_count = sum(chunk_result["sent"] for chunk_result in chunk_results)
+    failed_count = sum(chunk_result["failed"] for chunk_result in chunk_results)
+    logger.info(f"Sent {sent_count} promotion emails for promotion {promotion_uuid} in {len(chunk_results)} chunks, {failed_count} failed.")
+    return {"chunks": len(chunk_results), "sent": sent_count, "failed": failed_count}
+
+
+@shared_task(bind=True)
+def send_promotion_emails(self, promotion_uuid, subject):
+    promotion = PromotionModel.objects.select_related("category").get(uuid=promotion_uuid)
+
+    user_uuids = get_interested_user_uuids(promotion.category_id).iterator(chunk_size=settings.PROMOTION_EMAILS_CHUNK_SIZE)
+    user_uuids_chunks = [[str(user_uuid) for user_uuid in chunk] for chunk in chunked(user_uuids, settings.PROMOTION_EMAILS_CHUNK_SIZE)]
+    if not user_uuids_chunks:
+        logger.warning("No users to send promotion to!")
+        return {"chunks": 0}
+
+    promotion_email_path = "emails/category-default.html"
+    custom_promotion_email_path = f"emails/category-{snake_case(promotion.category.name)}"
+    try:
+        get_template(custom_promotion_email_path)
+        promotion_email_path = custom_promotion_email_path
+    except TemplateDoesNotExist as exception:
+        send_email_admins_html.delay(
+            "emails/promotion-template-does-not-exist.html",
+            {"category_name": promotion.category.name, "email_template": custom_promotion_email_path, "full_error": str(exception)},
+            "Promotion email template does not exist"
+        )
+
+    # Chunks are sent in parallel by whichever workers are free, the totals are logged once all of them finish
+    chord(
+        send_promotion_emails_html.s(promotion_email_path, user_uuids_chunk, promotion_uuid, subject)
+        for user_uuids_chunk in user_uuids_chunks
+    )(report_promotion_emails.s(promotion_uuid))
+    logger.info(f"Queued promotion emails for {promotion.name} in {len(user_uuids_chunks)} chunks.")
+    return {"chunks": len(user_uuids_chunks)}
 
 
 @shared_task(bind=True)
@@ -86,48 +153,267 @@ def delete_unconfirmed_users(self):
 
 @shared_task(bind=True)
 def send_newsletter_emails(self, content_path, subject):
-    users = ProfileModel.objects.all().filter(is_following_newsletter=True)
-
-    active_promotions = PromotionModel.objects.all().filter(start_date__lte=Now(), end_date__gte=Now())
-    max_discount = int(max([promotion.discount for promotion in active_promotions] + [0])) * 100
+    active_promotions = PromotionModel.objects.all().filter(start_date__lte=Now(), end_date__gte=Now()).select_related("category")
+    max_discount = int(max([promotion.discount for promotion in active_promotions] + [0]) * 100)
     categories = [promotion.category.name for promotion in active_promotions]
-    
+
     if max_discount == 0:
         logger.warning('No active promotions! No newsletter emails will be sent!')
         return
 
     content_data = {"max_discount": max_discount, "categories": ", ".join(categories)}
-    content = render_to_string(content_path, content_data)
+    send_newsletter_batch.delay(self.request.id or uuid.uuid4().hex, content_path, content_data, subject)
 
-    newsletter_emails = []
-    for user in users:
-        newsletter_email = EmailMultiAlternatives(
-            subject=subject,
-            body=content,
-            to=[user.email]
-        )
-        newsletter_email.content_subtype = "html"
-        newsletter_emails.append(newsletter_email)
 
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=3)
+def send_newsletter_batch(self, run_id, content_path, content_data, subject, last_user_uuid=None, sent_count=0, failed_count=0):
+    # One batch per task keeps every task far below the broker's visibility timeout, so only a crashed batch is redelivered.
+    # The batch is claimed under this task's id: a redelivery or retry keeps the id and carries on, while a second copy
+    # queued by a batch that crashed after chaining the next one finds the claim taken and stops
+    claim_key = f"newsletter:{run_id}:after:{last_user_uuid or 'start'}"
+    if not cache.add(claim_key, self.request.id, timeout=settings.NEWSLETTER_CHECKPOINT_TIMEOUT) and cache.get(claim_key) != self.request.id:
+        logger.info(f"Newsletter batch after {last_user_uuid} was already sent by another task, skipping it.")
+        return
+
+    users = ProfileModel.objects.all().filter(is_following_newsletter=True).order_by("uuid")
+    if last_user_uuid is not None:
+        users = users.filter(uuid__gt=last_user_uuid)
+    users_batch = list(users.values_list("uuid", "email")[:settings.NEWSLETTER_BATCH_SIZE])
+    if not users_batch:
+        logger.info(f"Sent {sent_count} newsletter emails, {failed_count} failed.")
+        return {"sent": sent_count, "failed": failed_count}
+
+    content = render_to_string(content_path, content_data)
     connection = get_connection()
-    connection.open()
-    connection.send_messages(newsletter_emails)
-    connection.close()
+    try:
+        connection.open()
+    except (SMTPException, OSError) as error:
+        # Nothing has been sent from this batch yet, so it can be retried as a whole
+        raise self.retry(exc=error, countdown=60)
+
+    try:
+        for _user_uuid, email in users_batch:
+            newsletter_email = EmailMultiAlternatives(
+                subject=subject,
+                body=content,
+                to=[email],
+                connection=connection
+            )
+            newsletter_email.content_subtype = "html"
+            try:
+                sent_count += newsletter_email.send(fail_silently=False)
+            except (SMTPException, OSError) as error:
+                failed_count += 1
+                logger.warning(f"Could not send the newsletter to {email}: {error}")
+    finally:
+        connection.close()
+
+    send_newsletter_batch.delay(run_id, content_path, content_data, subject, str(users_batch[-1][0]), sent_count, failed_count)
+    return {"sent": sent_count, "failed": failed_count}
+
+
+def run_discounts_calculation(category_uuids=None):
+    start_time = time.monotonic()
+    offers = get_category_offers(category_uuids) if category_uuids else None
+    updated_offer_uuids = update_offer_discounts(offers)
+    for updated_offer_uuids_batch in chunked(updated_offer_uuids, 1000):
+        refresh_offer_prices(OfferModel.objects.filter(uuid__in=updated_offer_uuids_batch))
+    duration = time.monotonic() - start_time
+
+    scope = f"{len(category_uuids)} categories" if category_uuids else "all categories"
+    logger.info(f"Updated discounts of {len(updated_offer_uuids)} offers for {scope} in {duration:.2f} seconds.")
+    return {"updated_offers": len(updated_offer_uuids), "duration": round(duration, 3)}
+
+
+def schedule_discounts_calculation(category_uuids=None):
+    if add_pending_discounts_calculation(category_uuids):
+        calculate_pending_discounts.apply_async(countdown=settings.DISCOUNTS_DEBOUNCE_SECONDS)
+
+
+@shared_task(bind=True)
+def calculate_discounts(self, category_uuids=None):
+    discounts_lock = get_discounts_lock()
+    if not discounts_lock.acquire(blocking=False):
+        logger.info("Discounts calculation already in progress, deferring this one.")
+        schedule_discounts_calculation(category_uuids)
+        return {"deferred": True}
+    try:
+        return run_discounts_calculation(category_uuids)
+    finally:
+        discounts_lock.release()
+
+
+@shared_task(bind=True, max_retries=None)
+def calculate_pending_discounts(self):
+    discounts_lock = get_discounts_lock()
+    if not discounts_lock.acquire(blocking=False):
+        raise self.retry(countdown=settings.DISCOUNTS_DEBOUNCE_SECONDS)
+    try:
+        category_uuids, triggers_count = pop_pending_discounts_calculation()
+        if triggers_count == 0:
+            return {"updated_offers": 0, "merged_triggers": 0}
+        result = run_discounts_calculation(category_uuids)
+    finally:
+        discounts_lock.release()
+
+    logger.info(f"Merged {triggers_count} discounts calculation triggers into one run.")
+    result["merged_triggers"] = triggers_count
+    return result
+
 
 @shared_task(bind=True)
-def calculate_discounts(self):
+def update_offer_prices(self, offer_uuids=None, currency_uuids=None):
     offers = OfferModel.objects.all()
-    active_promotions = PromotionModel.objects.all().filter(start_date__lte=Now(), end_date__gte=Now())
-    
-    for offer in offers:
-        discount = 0
-        for promotion in active_promotions:
-            if promotion.category in offer.product.categories.all():
-                discount = max(discount, promotion.discount)
-        offer.discount = discount
-        offer.save()
-        
+    if offer_uuids:
+        offers = offers.filter(uuid__in=offer_uuids)
+    if currency_uuids:
+        offers = offers.filter(currency__in=currency_uuids)
+    refreshed_count = refresh_offer_prices(offers)
+    logger.info(f"Refreshed {refreshed_count} offer prices.")
+    return refreshed_count
+
+
+@shared_task(bind=True)
+def expire_stocks(self):
+    checked_at = timezone.now()
+    expired_since = cache.get(STOCK_EXPIRY_CHECKED_AT_KEY)
+    refreshed_count = refresh_expired_product_stocks(expired_since)
+    cache.set(STOCK_EXPIRY_CHECKED_AT_KEY, checked_at, timeout=None)
+    logger.info(f"Removed expired stock from {refreshed_count} products.")
+    return refreshed_count
+
+
+@shared_task(bind=True)
+def delete_stock_tombstones(self):
+    deleted_count = delete_expired_stock_tombstones(settings.STOCK_TOMBSTONE_RETENTION_DAYS)
+    logger.info(f"Deleted {deleted_count} stock tombstones.")
+    return deleted_count
+
+
+# Offer views
+
+
+def record_offer_view(user_uuid, offer_uuid):
+    # Every full batch is flushed straight away, smaller ones wait for the periodic flush
+    buffered_count = buffer_offer_view(user_uuid, offer_uuid)
+    if buffered_count and buffered_count % settings.OFFER_VIEW_FLUSH_BATCH_SIZE == 0:
+        flush_offer_views.delay()
+
+
+@shared_task(bind=True)
+def flush_offer_views(self):
+    flushed_counts = flush_buffered_offer_views()
+    if flushed_counts is None:
+        logger.info("Offer views are already being flushed, skipping this flush.")
+        return {"skipped": True}
+    saved_count, trimmed_count = flushed_counts
+    logger.info(f"Saved {saved_count} offer views and trimmed {trimmed_count} from user histories.")
+    return {"saved": saved_count, "trimmed": trimmed_count}
+
+
+@shared_task(bind=True)
+def maintain_offer_view_partitions(self):
+    created_partitions = create_offer_view_partitions(settings.OFFER_VIEW_PARTITIONS_AHEAD)
+    dropped_partitions = drop_expired_offer_view_partitions(settings.OFFER_VIEW_RETENTION_MONTHS)
+    deleted_interests_count = delete_expired_category_interests(settings.OFFER_VIEW_RETENTION_MONTHS)
+    logger.info(
+        f"Created offer view partitions {created_partitions}, dropped {dropped_partitions} "
+        f"and deleted {deleted_interests_count} expired category interests.")
+    return {"created": created_partitions, "dropped": dropped_partitions, "deleted_interests": deleted_interests_count}
+
+
+# Invoices
+
+
+def schedule_order_invoice(order_uuid):
+    order_uuid = str(order_uuid)
+    invoice_pipeline = generate_order_invoice.s(order_uuid) | send_order_invoice_email.s(order_uuid)
+    transaction.on_commit(invoice_pipeline.delay)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def generate_order_invoice(self, order_uuid):
+    order = OrderModel.objects.select_related("user", "currency").get(uuid=order_uuid)
+    try:
+        return render_order_invoice(order)
+    except OSError as error:
+        raise self.retry(exc=error)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_order_invoice_email(self, invoice_path, order_uuid):
+    order = OrderModel.objects.select_related("user").get(uuid=order_uuid)
+    try:
+        content = render_to_string("emails/order-added.html", {'first_name': order.user.first_name})
+        invoice_email = EmailMessage(subject="Invoice", body=content, to=[order.user.email])
+        invoice_email.content_subtype = "html"
+        invoice_email.attach_file(settings.MEDIA_ROOT / invoice_path)
+        invoice_email.send(fail_silently=False)
+        return True
+    except OSError as error:
+        raise self.retry(exc=error)
+
+
+# Promotion boundaries
+
+
+def get_promotion_boundaries(promotion):
+    boundaries = {"start": promotion.start_date}
+    if promotion.end_date:
+        boundaries["end"] = promotion.end_date + timedelta(seconds=1)
+        boundaries["expire"] = promotion.end_date + timedelta(days=settings.PROMOTION_EXPIRED_RETENTION_DAYS)
+    return boundaries
+
+
+def get_promotion_boundary_task_name(promotion_uuid, boundary):
+    return f"promotion-{promotion_uuid}-{boundary}"
+
+
+def schedule_promotion_boundaries(promotion):
+    boundaries = get_promotion_boundaries(promotion)
+    for boundary in ["start", "end", "expire"]:
+        task_name = get_promotion_boundary_task_name(promotion.uuid, boundary)
+        boundary_time = boundaries.get(boundary)
+        if boundary_time is None or boundary_time <= timezone.now():
+            PeriodicTask.objects.filter(name=task_name).delete()
+            continue
+
+        clocked_schedule, _created = ClockedSchedule.objects.get_or_create(clocked_time=boundary_time)
+        PeriodicTask.objects.update_or_create(
+            name=task_name,
+            defaults={
+                "task": "client.tasks.apply_promotion_boundary",
+                "clocked": clocked_schedule,
+                "one_off": True,
+                "enabled": True,
+                "kwargs": json.dumps({"promotion_uuid": str(promotion.uuid), "boundary": boundary})
+            }
+        )
+
+
+def unschedule_promotion_boundaries(promotion_uuids):
+    task_names = [get_promotion_boundary_task_name(promotion_uuid, boundary) for promotion_uuid in promotion_uuids for boundary in ["start", "end", "expire"]]
+    PeriodicTask.objects.filter(name__in=task_names).delete()
+
+
+@shared_task(bind=True)
+def apply_promotion_boundary(self, promotion_uuid, boundary):
+    promotion = PromotionModel.objects.filter(uuid=promotion_uuid).first()
+    if promotion is None:
+        logger.warning(f"Promotion {promotion_uuid} no longer exists, skipping its {boundary} boundary.")
+        return
+
+    if boundary == "expire":
+        delete_expired_promotions(promotion_uuid=promotion_uuid)
+    else:
+        logger.info(f"Promotion {promotion.name} reached its {boundary} boundary, recalculating discounts.")
+        schedule_discounts_calculation([str(promotion.category_id)])
+
+
 @shared_task(bind=True)
-def delete_expired_promotions(self):
-    expired_promotions = PromotionModel.objects.all().filter(end_date__lt=Now())
-    expired_promotions.delete()
\ No newline at end of file
+def delete_expired_promotions(self, promotion_uuid=None):
+    expired_promotions = PromotionModel.objects.all().filter(end_date__lt=Now() - timedelta(days=settings.PROMOTION_EXPIRED_RETENTION_DAYS))
+    if promotion_uuid:
+        expired_promotions = expired_promotions.filter(uuid=promotion_uuid)
+    unschedule_promotion_boundaries(expired_promotions.values_list("uuid", flat=True))
+    expired_promotions.delete()
@@ -13,17 +13,6 @@ def add_class(field, css_class):
     return field.as_widget(attrs={"class": css_class})
 
 
-@register.filter
-def get_price_display(offer, currency_conversion):
-    logger.info(offer.get_price(currency_conversion))
-    return offer.get_price(currency_conversion)
-
-
-@register.filter
-def get_price_discounted_display(offer, currency_conversion):
-    return offer.get_price_discounted(currency_conversion)
-
-
 @register.simple_tag
 def default_currency():
     return settings.DEFAULT_CURRENCY_CODE
@@ -1,3 +1,160 @@
-from django.test import TestCase
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from django.utils import timezone
+from .models import ProfileModel, CurrencyModel, OrderModel, OrderOfferStockModel, ProductModel, ProductStockModel, SupplierModel, StockModel, OfferModel
+from .orders import LOCK_NOT_AVAILABLE_SQLSTATE, StockContentionError, place_order, place_order_once
+from .rates import CurrencyRates, invalidate_currency_rates
+from .stock import InsufficientStockError
+from .views import get_cursor_paginated_objects
 
-# Create your tests here.
+ORDER_LIST_ORDERING = ["-date", "-uuid"]
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        user = ProfileModel.objects.create_user(username="cursor", email="cursor@example.com", phone_number="+40700000000")
+        currency = CurrencyModel.objects.create(name="Cursor currency", code="CUR")
+        orders = [
+            OrderModel.objects.create(user=user, phone_number=user.phone_number, currency=currency, total_price=0)
+            for _ in range(7)
+        ]
+        # Several orders share a millisecond and differ only in their microseconds
+        date = timezone.now().replace(microsecond=123000)
+        for index, order in enumerate(orders):
+            order.date = date + timedelta(microseconds=index // 2 * 100)
+        OrderModel.objects.bulk_update(orders, ["date"])
+        self.orders = OrderModel.objects.filter(user=user)
+        self.expected_uuids = list(self.orders.order_by(*ORDER_LIST_ORDERING).values_list("uuid", flat=True))
+
+    def get_page(self, cursor=None):
+        request = RequestFactory().get("/", {"records_per_page": 2, **({"cursor": cursor} if cursor else {})})
+        orders, cursors = get_cursor_paginated_objects(request, self.orders, ORDER_LIST_ORDERING)
+        return [order.uuid for order in orders], cursors
+
+    def test_next_pages_cover_every_order_once(self):
+        page_uuids, cursors = self.get_page()
+        seen_uuids = list(page_uuids)
+        while cursors["next"]:
+            page_uuids, cursors = self.get_page(cursors["next"])
+            seen_uuids += page_uuids
+        self.assertEqual(seen_uuids, self.expected_uuids)
+
+    def test_previous_pages_return_to_the_same_orders(self):
+        pages = [self.get_page()]
+        while pages[-1][1]["next"]:
+            pages.append(self.get_page(pages[-1][1]["next"]))
+        for page_index in range(len(pages) - 1, 0, -1):
+            previous_uuids, _cursors = self.get_page(pages[page_index][1]["previous"])
+            self.assertEqual(previous_uuids, pages[page_index - 1][0])
+
+
+class CheckoutTestCase(TestCase):
+    def setUp(self):
+        self.user = ProfileModel.objects.create_user(username="checkout", email="checkout@example.com", phone_number="+40700000000")
+        self.currency = CurrencyModel.objects.create(name="Checkout currency", code="CHK")
+        # Rates are normally invalidated on commit, which never happens inside a test
+        invalidate_currency_rates()
+        supplier = SupplierModel.objects.create(name="Checkout supplier")
+        self.product = ProductModel.objects.create(name="Checkout product")
+        self.stock = StockModel.objects.create(product=self.product, supplier=supplier, quantity=3, reception_date=timezone.now())
+        self.offer = OfferModel.objects.create(product=self.product, price=10, currency=self.currency)
+
+    def assertStockLeft(self, quantity):
+        self.assertEqual(ProductStockModel.objects.get(product=self.product).quantity, quantity)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, quantity)
+
+
+class PlaceOrderTests(CheckoutTestCase):
+    def test_order_reserves_and_draws_stock(self):
+        order = place_order(self.user, self.currency, {str(self.offer.uuid): 2})
+        self.assertEqual(order.total_price, 20)
+        self.assertStockLeft(1)
+        self.assertEqual(OrderOfferStockModel.objects.filter(order_offer__order=order).count(), 1)
+
+    def test_insufficient_stock_rolls_back(self):
+        with self.assertRaises(InsufficientStockError):
+            place_order(self.user, self.currency, {str(self.offer.uuid): 4})
+        self.assertFalse(OrderModel.objects.filter(user=self.user).exists())
+        self.assertStockLeft(3)
+
+    def test_lock_timeout_raises_stock_contention(self):
+        # Django keeps the driver error as the cause, its pgcode tells a lock timeout from other failures
+        driver_error = Exception("canceling statement due to lock timeout")
+        driver_error.pgcode = LOCK_NOT_AVAILABLE_SQLSTATE
+        lock_timeout = OperationalError(str(driver_error))
+        lock_timeout.__cause__ = driver_error
+        with mock.patch("client.orders.reserve_product_stocks", side_effect=lock_timeout):
+            with self.assertRaises(StockContentionError):
+                place_order(self.user, self.currency, {str(self.offer.uuid): 1})
+        self.assertFalse(OrderModel.objects.filter(user=self.user).exists())
+
+    def test_other_database_errors_are_not_contention(self):
+        with mock.patch("client.orders.reserve_product_stocks", side_effect=OperationalError("server closed the connection")):
+            with self.assertRaises(OperationalError):
+                place_order(self.user, self.currency, {str(self.offer.uuid): 1})
+
+
+class PlaceOrderOnceTests(CheckoutTestCase):
+    def place_order_once(self, idempotency_key):
+        return place_order_once(self.user, self.currency, {str(self.offer.uuid): 1}, idempotency_key)
+
+    def test_duplicate_key_returns_the_same_order(self):
+        idempotency_key = uuid.uuid4()
+        order_uuid, created = self.place_order_once(idempotency_key)
+        duplicate_order_uuid, duplicate_created = self.place_order_once(idempotency_key)
+        self.assertEqual((created, duplicate_created), (True, False))
+        self.assertEqual(duplicate_order_uuid, order_uuid)
+        self.assertEqual(OrderModel.objects.filter(user=self.user).count(), 1)
+        self.assertStockLeft(2)
+
+    def test_committed_key_is_answered_from_the_cache(self):
+        idempotency_key = uuid.uuid4()
+        with self.captureOnCommitCallbacks(execute=True):
+            order_uuid, _created = self.place_order_once(idempotency_key)
+        with mock.patch("client.orders.get_idempotent_order_uuid") as get_idempotent_order_uuid:
+            self.assertEqual(self.place_order_once(idempotency_key), (order_uuid, False))
+        get_idempotent_order_uuid.assert_not_called()
+
+    def test_concurrent_duplicate_returns_the_committed_order(self):
+        idempotency_key = uuid.uuid4()
+        order_uuid, _created = self.place_order_once(idempotency_key)
+        # The duplicate misses the first order when it checks, then collides with it on the unique key
+        with mock.patch("client.orders.get_idempotent_order_uuid", side_effect=[None, order_uuid]):
+            self.assertEqual(self.place_order_once(idempotency_key), (order_uuid, False))
+        self.assertEqual(OrderModel.objects.filter(user=self.user).count(), 1)
+        self.assertStockLeft(2)
+
+
+class CurrencyRatesTests(SimpleTestCase):
+    def setUp(self):
+        self.base, self.euro, self.dollar, self.pound = (uuid.uuid4() for _ in range(4))
+
+    def test_cross_rate_is_the_product_of_its_base_legs(self):
+        currency_rates = CurrencyRates(self.base, [(self.base, self.euro, Decimal("0.2")), (self.base, self.dollar, Decimal("0.25"))])
+        cross_rate = currency_rates.get_rate(self.euro, self.dollar)
+        self.assertEqual(cross_rate, currency_rates.get_rate(self.euro, self.base) * currency_rates.get_rate(self.base, self.dollar))
+        self.assertEqual(cross_rate, Decimal("1.25"))
+
+    def test_rate_towards_the_base_is_inverted(self):
+        currency_rates = CurrencyRates(self.base, [(self.pound, self.base, Decimal("5")), (self.base, self.euro, Decimal("0.2"))])
+        self.assertEqual(currency_rates.get_rate(self.base, self.pound), Decimal("0.2"))
+        self.assertEqual(currency_rates.get_rate(self.pound, self.euro), Decimal("1"))
+
+    def test_explicit_pair_takes_precedence_over_the_cross_rate(self):
+        currency_rates = CurrencyRates(self.base, [
+            (self.base, self.euro, Decimal("0.2")),
+            (self.base, self.dollar, Decimal("0.25")),
+            (self.euro, self.dollar, Decimal("1.3"))
+        ])
+        self.assertEqual(currency_rates.get_rate(self.euro, self.dollar), Decimal("1.3"))
+        self.assertEqual(currency_rates.get_rate(self.dollar, self.euro), Decimal("0.8"))
+
+    def test_currency_without_a_base_leg_has_no_rate(self):
+        currency_rates = CurrencyRates(self.base, [(self.base, self.euro, Decimal("0.2"))])
+        self.assertIsNone(currency_rates.get_rate(self.euro, self.pound))
+        self.assertEqual(currency_rates.convert([Decimal("10")], self.base, self.euro), [Decimal("2.0")])
@@ -40,7 +40,8 @@ promotion_urlpatterns = [
 ]
 
 stock_urlpatterns = [
-    path("list/offers", views.stock_list_offers, name="stock-list-offers")
+    path("list/offers", views.stock_list_offers, name="stock-list-offers"),
+    path("watch/offers", views.stock_watch_offers, name="stock-watch-offers")
 ]
 
 currency_urlpatterns = [
@@ -2,38 +2,36 @@ import re
 import io
 import uuid
 import json
-import time
+import base64
 import logging
 from datetime import datetime
 from ipware import get_client_ip
-from reportlab.pdfgen import canvas
 from django import forms
 from django.conf import settings
 from django.urls import reverse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.models import Permission
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.views.decorators.http import condition
 from django.core.paginator import Paginator, EmptyPage
-from django.template.loader import get_template, TemplateDoesNotExist
-from django.db.models import Count
-from .models import ProductModel, UnitModel, ProfileModel, OfferModel, OfferViewModel, PromotionModel, StockModel, CurrencyModel, OrderModel, OrderOfferModel, CurrencyConversionModel
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import ProductModel, UnitModel, ProfileModel, OfferModel, PromotionModel, ProductStockModel, StockTombstoneModel, CurrencyModel, OrderModel
 from .forms import FilterProductsForm, ProductAddEditForm, FilterOffersForm, FilterPromotionsForm, PromotionAddEditForm, ContactForm, SigninForm, SignupForm, ChangePasswordForm
-from .dto import ProductListDto, OfferListDto, PromotionListDto, CurrencyListDto, OrderListDto
-from .tasks import send_email_html, send_promotion_emails_html, send_email_admins_html, calculate_discounts
+from .dto import PromotionListDto, CurrencyListDto, OrderListDto, get_order_list_rows, PRODUCT_LIST_FIELDS, OFFER_LIST_FIELDS, OFFER_PRICED_LIST_FIELDS, get_product_list_dtos, get_offer_list_dtos, get_priced_offer_list_dtos
+from .pricing import get_offer_prices, annotate_offer_prices
+from .push import get_offer_key, get_product_key, stream_changes
+from .search import search_products
+from .orders import StockContentionError, place_order_once
+from .stock import InsufficientStockError, get_stock_version, get_latest_stock_version, get_deleted_stock_version
+from .tasks import send_email_html, send_promotion_emails, send_email_admins_html, schedule_discounts_calculation, schedule_promotion_boundaries, unschedule_promotion_boundaries, schedule_order_invoice, record_offer_view
 
 # Utilities
 
 logger = logging.getLogger('django')
 
 
-def snake_case(s):
-    return '_'.join(
-        re.sub('([A-Z][a-z]+)', r' \1',
-               re.sub('([A-Z]+)', r' \1',
-                      s.replace('-', ' '))).split()).lower()
-
-
 def get_ip_address(request):
     ip_address, _is_routable = get_client_ip(request)
     if ip_address is None:
@@ -80,9 +78,18 @@ def permissions_required(permissions):
 # Pagination
 
 
+def get_records_per_page(request):
+    try:
+        records_per_page = int(request.GET.get("records_per_page", 10))
+    except ValueError:
+        logger.warning("Invalid records per page value! Reverting to default value.")
+        records_per_page = 10
+    return max(1, min(records_per_page, settings.RECORDS_PER_PAGE_MAX))
+
+
 def get_paginated_objects(request, objects_list):
     page_number = request.GET.get("page_number", 1)
-    records_per_page = request.GET.get("records_per_page", 10)
+    records_per_page = get_records_per_page(request)
     paginator = Paginator(objects_list, per_page=records_per_page)
     try:
         objects_list = paginator.page(page_number).object_list
@@ -95,6 +102,100 @@ def get_paginated_objects(request, objects_list):
     return (objects_list, pages)
 
 
+class CursorJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, which would make keyset filters skip or repeat rows
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, direction):
+    cursor = json.dumps({"values": values, "direction": direction}, cls=CursorJSONEncoder)
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor["direction"] not in ("next", "previous") or not isinstance(cursor["values"], list):
+            raise ValueError
+        return cursor
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Invalid pagination cursor! Reverting to first page.")
+        return None
+
+
+def get_keyset_filter(ordering, values, backwards):
+    # Expands (a, b) > (x, y) into a > x OR (a = x AND b > y), honoring each field's direction
+    keyset_filter = Q(pk__in=[])
+    previous_fields_equal = Q()
+    for field, value in zip(ordering, values):
+        field_name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") != backwards else "gt"
+        keyset_filter |= previous_fields_equal & Q(**{f"{field_name}__{lookup}": value})
+        previous_fields_equal &= Q(**{field_name: value})
+    return keyset_filter
+
+
+def get_cursor_values(obj, ordering):
+    return [getattr(obj, field.lstrip("-")) for field in ordering]
+
+
+def get_estimated_count(objects_list):
+    plan = json.loads(objects_list.order_by().explain(format="json"))
+    return int(plan["Plan"]["Plan Rows"])
+
+
+def get_cursor_paginated_objects(request, objects_list, ordering):
+    records_per_page = get_records_per_page(request)
+    cursor = decode_cursor(request.GET.get("cursor"))
+    backwards = cursor is not None and cursor["direction"] == "previous"
+
+    estimated_total = get_estimated_count(objects_list) if request.GET.get("estimate_total") else None
+
+    if cursor is not None:
+        objects_list = objects_list.filter(get_keyset_filter(ordering, cursor["values"], backwards))
+    if backwards:
+        objects_list = objects_list.order_by(*[field[1:] if field.startswith("-") else f"-{field}" for field in ordering])
+    else:
+        objects_list = objects_list.order_by(*ordering)
+
+    objects_list = list(objects_list[:records_per_page + 1])
+    has_more = len(objects_list) > records_per_page
+    objects_list = objects_list[:records_per_page]
+    if backwards:
+        objects_list.reverse()
+
+    has_next = has_more if not backwards else True
+    has_previous = cursor is not None if not backwards else has_more
+
+    cursors = {
+        "next": encode_cursor(get_cursor_values(objects_list[-1], ordering), "next") if objects_list and has_next else None,
+        "previous": encode_cursor(get_cursor_values(objects_list[0], ordering), "previous") if objects_list and has_previous else None,
+        "records_per_page": records_per_page,
+        "estimated_total": estimated_total
+    }
+    return (objects_list, cursors)
+
+
+def get_ranked_ordering(objects_list, ordering, list_fields):
+    # Search results are keyed on their rank first, so cursor pages keep the relevance order
+    if "search_rank" not in objects_list.query.annotations:
+        return (ordering, list_fields)
+    return (["-search_rank", *ordering], [*list_fields, "search_rank"])
+
+
+def get_page(request, objects_list, ordering):
+    if request.GET.get("pagination") == "cursor":
+        objects_list, cursors = get_cursor_paginated_objects(request, objects_list, ordering)
+        return (objects_list, {"cursors": cursors})
+    objects_list, pages = get_paginated_objects(request, objects_list)
+    return (objects_list, {"pages": pages})
+
+
 # Presentation
 
 
@@ -323,16 +424,18 @@ def product_list(request):
             try:
                 name = filter_form.cleaned_data['name']
                 if name:
-                    all_products = all_products.filter(name__icontains=name)
+                    all_products = search_products(all_products, name)
 
                 category = filter_form.cleaned_data['category']
                 if category:
                     all_products = all_products.filter(
                         categories__in=[category.uuid]).distinct()
 
-                products, pages = get_paginated_objects(request, all_products)
-                products = [ProductListDto(product) for product in products]
-                return JsonResponse({"success": True, 'products': products, 'pages': pages})
+                ordering, list_fields = get_ranked_ordering(all_products, ["uuid"], PRODUCT_LIST_FIELDS)
+                all_products = all_products.values_list(*list_fields, named=True)
+                products, pagination = get_page(request, all_products, ordering)
+                products = get_product_list_dtos(products)
+                return JsonResponse({"success": True, 'products': products, **pagination})
             except ...:
                 logger.error("Could not return products list!")
                 return JsonResponse({"success": False})
@@ -390,6 +493,13 @@ def product_delete(request, product_uuid):
 # Offer
 
 
+OFFER_ORDERINGS = {
+    "": ["uuid"],
+    "price": ["offer_price_discounted", "uuid"],
+    "-price": ["-offer_price_discounted", "uuid"]
+}
+
+
 def offer_list(request):
     all_offers = OfferModel.objects.all().order_by("uuid")
 
@@ -402,16 +512,32 @@ def offer_list(request):
             try:
                 name = filter_form.cleaned_data['name']
                 if name:
-                    all_offers = all_offers.filter(product__name__icontains=name)
+                    all_offers = search_products(all_offers, name, product_field="product")
 
                 category = filter_form.cleaned_data['category']
                 if category:
                     all_offers = all_offers.filter(
                         product__categories__in=[category.uuid]).distinct()
 
-                offers, pages = get_paginated_objects(request, all_offers)
-                offers = [OfferListDto(offer, currency) for offer in offers]
-                return JsonResponse({"success": True, 'offers': offers, 'pages': pages})
+                all_offers = annotate_offer_prices(all_offers, currency)
+                min_price = filter_form.cleaned_data['min_price']
+                if min_price is not None:
+                    all_offers = all_offers.filter(offer_price_discounted__gte=min_price)
+                max_price = filter_form.cleaned_data['max_price']
+                if max_price is not None:
+                    all_offers = all_offers.filter(offer_price_discounted__lte=max_price)
+
+                order = filter_form.cleaned_data['order']
+                ordering, list_fields = OFFER_ORDERINGS[order], OFFER_PRICED_LIST_FIELDS
+                if order:
+                    all_offers = all_offers.order_by(*ordering)
+                else:
+                    ordering, list_fields = get_ranked_ordering(all_offers, ordering, list_fields)
+
+                all_offers = all_offers.values_list(*list_fields, named=True)
+                offers, pagination = get_page(request, all_offers, ordering)
+                offers = get_priced_offer_list_dtos(offers)
+                return JsonResponse({"success": True, 'offers': offers, **pagination})
             except ...:
                 logger.critical("Could not return offer list!")
         else:
@@ -429,16 +555,12 @@ def offer_view(request, offer_uuid):
 
         currency_code = request.GET.get("currency", settings.DEFAULT_CURRENCY_CODE)
         currency = CurrencyModel.objects.get(code=currency_code)
-        currency_conversion = CurrencyConversionModel.objects.get(source=offer.currency, destination=currency)
+        offer_price = get_offer_prices([offer], currency)[offer.uuid]
 
         if request.user.is_authenticated:
-            user_offer_views = OfferViewModel.objects.filter(user=request.user).order_by("date_time")
-            offer_view = OfferViewModel(user=request.user, offer=offer)
-            if user_offer_views.count() >= settings.OFFER_VIEW_USER_HISTORY_SIZE:
-                user_offer_views.first().delete()
-            offer_view.save()
+            record_offer_view(request.user.pk, offer.uuid)
 
-        return render(request, 'pages/offer/offer-view.html', {'offer': offer, 'currency_conversion': currency_conversion})
+        return render(request, 'pages/offer/offer-view.html', {'offer': offer, 'offer_price': offer_price})
     else:
         return HttpResponseNotFound()
 
@@ -453,8 +575,8 @@ def cart(request):
         currency_code = request.GET.get("currency", settings.DEFAULT_CURRENCY_CODE)
         currency = CurrencyModel.objects.get(code=currency_code)
 
-        offers = OfferModel.objects.all().filter(uuid__in=data['offers'])
-        return JsonResponse({'offers': [OfferListDto(offer, currency) for offer in offers]})
+        offers = OfferModel.objects.all().filter(uuid__in=data['offers']).values_list(*OFFER_LIST_FIELDS, named=True)
+        return JsonResponse({'offers': get_offer_list_dtos(offers, currency)})
     elif request.method == 'GET':
         return render(request, 'pages/order/cart.html')
     else:
@@ -463,112 +585,6 @@ def cart(request):
 # Order
 
 
-def generate_invoice_page_information(pdf, page_index, order, total_price):
-    title = pdf.beginText(50, 780)
-    title.setFont("Helvetica", 22)
-    title.textLine("Online store")
-
-    subtitle = pdf.beginText(50, 760)
-    subtitle.setFont("Helvetica", 16)
-    subtitle.textLine("Invoice")
-
-    price = pdf.beginText(50, 740)
-    price.setFont("Helvetica", 12)
-    price.textLine(f"Price: {total_price} {order.currency.code}")
-
-    admin_email = pdf.beginText(50, 720)
-    admin_email.setFont("Helvetica", 12)
-    admin_email.textLine("Administrator email:")
-    admin_email.textLine(settings.ADMINS[0][1])
-
-    pdf.drawText(title)
-    pdf.drawText(subtitle)
-    pdf.drawText(price)
-    pdf.drawText(admin_email)
-
-    full_name = pdf.beginText(250, 790)
-    full_name.setFont("Helvetica", 12)
-    full_name.textLine(f"Full name: {order.user.get_full_name()}")
-
-    email = pdf.beginText(250, 770)
-    email.setFont("Helvetica", 12)
-    email.textLine(f"Email: {order.user.email}")
-
-    phone_number = pdf.beginText(250, 750)
-    phone_number.setFont("Helvetica", 12)
-    phone_number.textLine(f"Phone number: {order.user.phone_number}")
-
-    location = pdf.beginText(250, 730)
-    location.setFont("Helvetica", 12)
-    location.textLine(f"Location: {order.user.country} {order.user.city}")
-
-    address = pdf.beginText(250, 710)
-    address.setFont("Helvetica", 12)
-    address.textLine(f"Full address: {order.user.address_line_one} {order.user.address_line_two}")
-
-    pdf.drawText(full_name)
-    pdf.drawText(email)
-    pdf.drawText(phone_number)
-    pdf.drawText(location)
-    pdf.drawText(address)
-
-    page_number = pdf.beginText(50, 50)
-    page_number.setFont("Helvetica", 12)
-    page_number.textLine(f"Page {int(page_index)}")
-
-    pdf.drawText(page_number)
-
-
-def generate_invoice(path, order):
-    offers_per_page = 6
-
-    pdf = canvas.Canvas(path)
-    pdf.setFont("Helvetica", 12)
-
-    order_offers = OrderOfferModel.objects.filter(order=order)
-
-    for index, order_offer in enumerate(order_offers):
-        offer_box_y = 580 - (index % offers_per_page) * 100
-        pdf.rect(50, offer_box_y, 500, 100)
-
-        offer_name = pdf.beginText(70, offer_box_y + 70)
-        offer_name.setFont("Helvetica", 16)
-        offer_name.textLine(order_offer.offer.product.name)
-
-        offer_description = pdf.beginText(70, offer_box_y + 55)
-        offer_description.setFont("Helvetica", 12)
-        offer_description.textLine(order_offer.offer.product.description)
-
-        offer_quantity = pdf.beginText(70, offer_box_y + 20)
-        offer_quantity.setFont("Helvetica", 12)
-        offer_quantity.textLine(f"Quantity: {order_offer.quantity}")
-
-        offer_price_str = f"Price: {order_offer.quantity * order_offer.price} {order.currency.code}"
-        offer_price_str_width = int(pdf.stringWidth(offer_price_str, "Helvetica", 12))
-        offer_price = pdf.beginText(530 - offer_price_str_width, offer_box_y + 20)
-        offer_price.setFont("Helvetica", 12)
-        offer_price.textLine(offer_price_str)
-
-        pdf.drawText(offer_name)
-        pdf.drawText(offer_description)
-        pdf.drawText(offer_quantity)
-        pdf.drawText(offer_price)
-
-        if index % offers_per_page == (offers_per_page - 1):
-            pdf.showPage()
-        if index % offers_per_page == 0:
-            generate_invoice_page_information(
-                pdf,
-                index / offers_per_page + 1,
-                order,
-                order.total_price
-            )
-
-    pdf.save()
-
-    return pdf
-
-
 @signin_required
 def order_add(request):
     if request.method == 'POST':
@@ -577,65 +593,21 @@ def order_add(request):
         currency_code = data['currency']
         currency = CurrencyModel.objects.get(code=currency_code)
 
-        product_stock = {product.uuid: 0 for product in ProductModel.objects.all()}
-
-        stocks = StockModel.objects.all()
-        for stock in stocks:
-            product_stock[stock.product.uuid] += int(stock.quantity)
-
-        order = OrderModel(
-            user=request.user,
-            full_address=request.user.get_full_address(),
-            phone_number=request.user.phone_number,
-            currency=currency
-        )
-
-        total_price = 0
-        order_offers = []
-        for offer_data in data['offers']:
-            offer = get_object_or_404(OfferModel, uuid=offer_data['offerUuid'])
-            currency_conversion = CurrencyConversionModel.objects.get(source=offer.currency, destination=currency)
-            quantity = int(offer_data['quantity'])
-            price = float(offer.get_price_discounted(currency_conversion))
-
-            total_price += float(offer.get_price_discounted(currency_conversion)) * quantity
-
-            order_offer = OrderOfferModel(
-                order=order,
-                offer=offer,
-                quantity=quantity,
-                price=price
-            )
-            order_offers.append(order_offer)
-
-            product_stock[offer.product.uuid] -= quantity
-            if product_stock[offer.product.uuid] < 0:
-                return JsonResponse({"success": False, "error": "Attempting to purchase more items than are in stock!"})
-
-        order.total_price = total_price
-        order.save()
-
-        for order_offer in order_offers:
-            order_offer.save()
-
-        timestamp = int(time.time())
-        pdf_name = f"invoice-{timestamp}.pdf"
-        pdf_relative_path = f"pdf/{pdf_name}"
-        pdf_absolute_path = f"{settings.MEDIA_ROOT}/{pdf_relative_path}"
-
-        generate_invoice(pdf_absolute_path, order)
-        send_email_html.delay(
-            "emails/order-added.html",
-            {'first_name': request.user.first_name},
-            "Invoice",
-            [request.user.email],
-            attachments=[pdf_relative_path]
-        )
-
-        order.invoice = pdf_relative_path
-        order.save()
-
-        return JsonResponse({"success": True})
+        try:
+            offers_data = {offer_data['offerUuid']: int(offer_data['quantity']) for offer_data in data['offers']}
+            idempotency_key = uuid.UUID(data['idempotencyKey']) if data.get('idempotencyKey') else None
+            order_uuid, created = place_order_once(request.user, currency, offers_data, idempotency_key)
+        except OfferModel.DoesNotExist:
+            return HttpResponseNotFound()
+        except InsufficientStockError:
+            return JsonResponse({"success": False, "error": "Attempting to purchase more items than are in stock!"})
+        except (ValueError, StockContentionError) as error:
+            return JsonResponse({"success": False, "error": str(error)})
+
+        if created:
+            schedule_order_invoice(order_uuid)
+
+        return JsonResponse({"success": True, "order": order_uuid})
     else:
         return HttpResponseNotFound()
 
@@ -645,18 +617,19 @@ def order_list(request):
     if request.method == 'GET':
         return render(request, 'pages/order/order-list.html')
     elif request.method == 'POST':
-        all_orders = OrderModel.objects.all().filter(user=request.user)
+        summary = request.GET.get("lines") == "summary"
+        all_orders = get_order_list_rows(OrderModel.objects.filter(user=request.user), summary).order_by("-date", "-uuid")
 
-        orders, pages = get_paginated_objects(request, all_orders)
-        orders = [OrderListDto(order) for order in orders]
-        return JsonResponse({"success": True, 'orders': orders, 'pages': pages})
+        orders, pagination = get_page(request, all_orders, ["-date", "-uuid"])
+        orders = [OrderListDto(order, summary) for order in orders]
+        return JsonResponse({"success": True, 'orders': orders, **pagination})
     else:
         return HttpResponseNotFound()
 
 # Promotions
 
 
-def process_promotion_form(promotion_form):
+def process_promotion_form(promotion_form, previous_category_uuid=None):
     if promotion_form.is_valid():
         promotion = promotion_form.save(commit=False)
 
@@ -665,43 +638,14 @@ def process_promotion_form(promotion_form):
 
         promotion.save()
 
-        calculate_discounts.delay()
+        category_uuids = {str(promotion.category_id)}
+        if previous_category_uuid:
+            category_uuids.add(str(previous_category_uuid))
+        schedule_discounts_calculation(list(category_uuids))
+        schedule_promotion_boundaries(promotion)
 
         if promotion.get_active():
-            offers = OfferModel.objects.all().filter(product__categories__in=[promotion.category])
-            offer_uuids = [offer.uuid for offer in offers]
-            offer_views = OfferViewModel.objects.all().filter(offer__in=offer_uuids)
-            offer_views_users = offer_views.values('user', 'offer').order_by().annotate(view_count=Count('offer'))
-
-            user_uuids = set()
-            for offer_views_user in offer_views_users:
-                if offer_views_user.get("view_count") >= settings.OFFER_VIEW_PROMOTION_MINIMUM_INTEREST:
-                    user_uuids.add(offer_views_user.get("user"))
-
-            if len(user_uuids) > 0:
-                users = ProfileModel.objects.all().filter(uuid__in=list(user_uuids))
-
-                promotion_email_path = "emails/category-default.html"
-                custom_promotion_email_path = f"emails/category-{snake_case(promotion.category.name)}"
-                try:
-                    get_template(custom_promotion_email_path)
-                    promotion_email_path = custom_promotion_email_path
-                except TemplateDoesNotExist as exception:
-                    send_email_admins_html.delay(
-                        "emails/promotion-template-does-not-exist.html",
-                        {"category_name": promotion.category.name, "email_template": custom_promotion_email_path, "full_error": str(exception)},
-                        "Promotion email template does not exist"
-                    )
-
-                send_promotion_emails_html.delay(
-                    promotion_email_path,
-                    users,
-                    promotion,
-                    promotion_form.cleaned_data["subject"]
-                )
-                logger.info(f"Sent promotion emails for {promotion.name}")
-            else:
-                logger.warning("No users to send promotion to!")
+            send_promotion_emails.delay(str(promotion.uuid), promotion_form.cleaned_data["subject"])
         return JsonResponse({'success': True})
     else:
         return JsonResponse({'success': False, 'errors': promotion_form.errors})
@@ -723,9 +667,9 @@ def promotion_list(request):
                 if category:
                     all_promotions = all_promotions.filter(category=category).distinct()
 
-                promotions, pages = get_paginated_objects(request, all_promotions)
+                promotions, pagination = get_page(request, all_promotions, ["uuid"])
                 promotions = [PromotionListDto(promotion) for promotion in promotions]
-                return JsonResponse({"success": True, 'promotions': promotions, 'pages': pages})
+                return JsonResponse({"success": True, 'promotions': promotions, **pagination})
             except ...:
                 logger.error("Could not return promotions list!")
                 return JsonResponse({"success": False})
@@ -756,8 +700,9 @@ def promotion_add(request):
 def promotion_edit(request, promotion_uuid):
     if request.method == 'POST':
         existing_promotion = PromotionModel.objects.get(uuid=promotion_uuid)
+        previous_category_uuid = existing_promotion.category_id
         edit_form = PromotionAddEditForm(request.POST, instance=existing_promotion)
-        return process_promotion_form(edit_form)
+        return process_promotion_form(edit_form, previous_category_uuid)
     elif request.method == 'GET':
         promotion = PromotionModel.objects.get(uuid=promotion_uuid)
         edit_form = PromotionAddEditForm(instance=promotion, initial={"discount_percentage": promotion.discount * 100})
@@ -773,7 +718,8 @@ def promotion_delete(request, promotion_uuid):
         try:
             existing_promotion = PromotionModel.objects.get(uuid=promotion_uuid)
             existing_promotion.delete()
-            calculate_discounts.delay()
+            unschedule_promotion_boundaries([promotion_uuid])
+            schedule_discounts_calculation([str(existing_promotion.category_id)])
             return JsonResponse({'success': True})
         except ...:
             return JsonResponse({'success': False})
@@ -783,14 +729,66 @@ def promotion_delete(request, promotion_uuid):
 # Stock
 
 
+def get_stock_etag(request):
+    # Only stock writes and deleted tombstones change the tag, writes to unrelated tables leave it alone
+    return f"stock-{get_latest_stock_version()}-{get_deleted_stock_version()}"
+
+
+@condition(etag_func=get_stock_etag)
 def stock_list_offers(request):
     if request.method == "GET":
-        product_stock = {product.uuid.__str__(): 0 for product in ProductModel.objects.all()}
-        stocks = StockModel.objects.all()
-        for stock in stocks:
-            product_stock[stock.product.uuid.__str__()] += int(stock.quantity)
-        offer_product = {offer.uuid.__str__(): offer.product.uuid.__str__() for offer in OfferModel.objects.all()}
-        return JsonResponse({"product_stock": product_stock, "offer_product": offer_product})
+        # Read once before the rows, so nothing committed below it can be missing from them
+        version = get_stock_version()
+        product_stocks = ProductStockModel.objects.all()
+        offers = OfferModel.objects.all()
+        deleted_offers, deleted_products = [], []
+
+        # Clients sending the version they last saw only receive what changed since, including what was deleted; versions
+        # from before the last deleted tombstones or from ahead of this database get the whole stock instead
+        try:
+            since_version = int(request.GET["version"])
+            if not get_deleted_stock_version() <= since_version <= version:
+                raise ValueError(since_version)
+            product_stocks = product_stocks.filter(version__gt=since_version)
+            offers = offers.filter(stock_version__gt=since_version)
+            tombstones = list(StockTombstoneModel.objects.filter(version__gt=since_version).values_list("uuid", "kind"))
+            deleted_offers = [str(tombstone_uuid) for tombstone_uuid, kind in tombstones if kind == "offer"]
+            deleted_products = [str(tombstone_uuid) for tombstone_uuid, kind in tombstones if kind == "product"]
+        except (KeyError, ValueError):
+            since_version = None
+
+        product_stock = {str(product_uuid): int(quantity) for product_uuid, quantity in product_stocks.values_list("product_id", "quantity")}
+        offer_product = {str(offer_uuid): str(product_uuid) for offer_uuid, product_uuid in offers.values_list("uuid", "product_id")}
+        return JsonResponse({
+            "version": version,
+            "full": since_version is None,
+            "product_stock": product_stock,
+            "offer_product": offer_product,
+            "deleted_offers": deleted_offers,
+            "deleted_products": deleted_products
+        })
+    else:
+        return HttpResponseNotFound()
+
+
+async def stock_watch_offers(request):
+    if request.method == "GET":
+        offer_uuids = set()
+        for offer_uuid in request.GET.get("offers", "").split(",")[:settings.PUSH_WATCHED_OFFERS_MAX]:
+            try:
+                offer_uuids.add(uuid.UUID(offer_uuid))
+            except ValueError:
+                continue
+
+        keys = [get_offer_key(offer_uuid) for offer_uuid in offer_uuids]
+        async for product_uuid in OfferModel.objects.filter(uuid__in=offer_uuids).values_list("product_id", flat=True).distinct():
+            keys.append(get_product_key(product_uuid))
+
+        return StreamingHttpResponse(
+            stream_changes(keys),
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     else:
         return HttpResponseNotFound()
 
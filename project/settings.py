@@ -36,6 +36,7 @@ ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS").split(" ")
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sitemaps',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'client.apps.ClientConfig',
     'project',
     'cities_light',
@@ -83,6 +85,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
+ASGI_APPLICATION = 'project.asgi.application'
 
 
 # Database
@@ -125,6 +128,9 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_TIMEZONE = "UTC"
+CELERY_TASK_ROUTES = {
+    "client.tasks.generate_order_invoice": {"queue": "invoices"}
+}
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_BEAT_SCHEDULE = {
@@ -139,7 +145,27 @@ CELERY_BEAT_SCHEDULE = {
     },
     "calculate_discounts": {
         "task": "client.tasks.calculate_discounts",
-        "schedule": crontab(minute="*/15")
+        "schedule": crontab(minute="0", hour="3")
+    },
+    "update_offer_prices": {
+        "task": "client.tasks.update_offer_prices",
+        "schedule": crontab(minute="30", hour="3")
+    },
+    "expire_stocks": {
+        "task": "client.tasks.expire_stocks",
+        "schedule": crontab(minute="0")
+    },
+    "delete_stock_tombstones": {
+        "task": "client.tasks.delete_stock_tombstones",
+        "schedule": crontab(minute="30", hour="2")
+    },
+    "flush_offer_views": {
+        "task": "client.tasks.flush_offer_views",
+        "schedule": crontab(minute="*")
+    },
+    "maintain_offer_view_partitions": {
+        "task": "client.tasks.maintain_offer_view_partitions",
+        "schedule": crontab(minute="0", hour="2")
     },
     "delete_expired_promotions": {
         "task": "client.tasks.delete_expired_promotions",
@@ -257,10 +283,26 @@ DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL")
 
 # Client specifics
 
+STOCK_TOMBSTONE_RETENTION_DAYS = int(os.environ.get("STOCK_TOMBSTONE_RETENTION_DAYS", default=7))
 OFFER_VIEW_USER_HISTORY_SIZE = int(os.environ.get("OFFER_VIEW_USER_HISTORY_SIZE", default=10))
+OFFER_VIEW_RETENTION_MONTHS = int(os.environ.get("OFFER_VIEW_RETENTION_MONTHS", default=12))
+OFFER_VIEW_PARTITIONS_AHEAD = int(os.environ.get("OFFER_VIEW_PARTITIONS_AHEAD", default=2))
+OFFER_VIEW_FLUSH_BATCH_SIZE = int(os.environ.get("OFFER_VIEW_FLUSH_BATCH_SIZE", default=500))
+OFFER_VIEW_FLUSH_LOCK_TIMEOUT = int(os.environ.get("OFFER_VIEW_FLUSH_LOCK_TIMEOUT", default=300))
 OFFER_VIEW_PROMOTION_MINIMUM_INTEREST = int(os.environ.get("OFFER_VIEW_PROMOTION_MINIMUM_INTEREST", default=3))
 SIGNIN_FAILED_ATTEMPTS_COUNT_TRIGGER = int(os.environ.get("SIGNIN_FAILED_ATTEMPTS_COUNT_TRIGGER", default=3))
 DEFAULT_CURRENCY_CODE = os.environ.get("DEFAULT_CURRENCY_CODE", default="RON")
+BASE_CURRENCY_CODE = os.environ.get("BASE_CURRENCY_CODE", default=DEFAULT_CURRENCY_CODE)
+RECORDS_PER_PAGE_MAX = int(os.environ.get("RECORDS_PER_PAGE_MAX", default=100))
+DISCOUNTS_DEBOUNCE_SECONDS = int(os.environ.get("DISCOUNTS_DEBOUNCE_SECONDS", default=5))
+DISCOUNTS_LOCK_TIMEOUT = int(os.environ.get("DISCOUNTS_LOCK_TIMEOUT", default=600))
+NEWSLETTER_BATCH_SIZE = int(os.environ.get("NEWSLETTER_BATCH_SIZE", default=500))
+NEWSLETTER_CHECKPOINT_TIMEOUT = int(os.environ.get("NEWSLETTER_CHECKPOINT_TIMEOUT", default=7 * 24 * 3600))
+PROMOTION_EMAILS_CHUNK_SIZE = int(os.environ.get("PROMOTION_EMAILS_CHUNK_SIZE", default=200))
+PROMOTION_EXPIRED_RETENTION_DAYS = int(os.environ.get("PROMOTION_EXPIRED_RETENTION_DAYS", default=30))
+CHECKOUT_LOCK_TIMEOUT_MS = int(os.environ.get("CHECKOUT_LOCK_TIMEOUT_MS", default=2000))
+CHECKOUT_IDEMPOTENCY_TTL = int(os.environ.get("CHECKOUT_IDEMPOTENCY_TTL", default=3600))
+PUSH_WATCHED_OFFERS_MAX = int(os.environ.get("PUSH_WATCHED_OFFERS_MAX", default=100))
 
 # Administration
 